@@ -3,7 +3,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 
 
-from .models import Book, Genre, Banner, BookFiles, Event
+from .models import Book, Genre, Banner, BookFiles, Event, apply_event
 
 
 class BookFilesInline(admin.TabularInline):
@@ -15,21 +15,14 @@ class BookFilesInline(admin.TabularInline):
 class EventForm(forms.ModelForm):
     def clean(self):
         """
-        Если указана цель жанры или все книги,
-        для каждой книги в жанре или всех книг
-        создается m2m модель.
+        Книги акции на жанры или на все книги привязываются
+        после сохранения в EventAdmin.save_related.
         """
         data = self.cleaned_data
         if 'event_on' not in data:
             raise ValidationError(
                 'Укажите цель акции'
             )
-        event_on = data['event_on']
-        if event_on == 'genres':
-            for genre in data['genres']:
-                data['books'] = genre.books.all()
-        if event_on == 'all_books':
-            data['books'] = Book.objects.all()
 
 
 @admin.register(Book)
@@ -57,6 +50,12 @@ class EventAdmin(admin.ModelAdmin):
                     break
         return super(EventAdmin, self).get_form(request, obj, **kwargs)
 
+    def save_related(self, request, form, formsets, change):
+        """Для акции на жанры или все книги создаются связи с книгами"""
+        super(EventAdmin, self).save_related(request, form, formsets, change)
+        if form.instance.event_on in ('genres', 'all_books'):
+            apply_event(form.instance)
+
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import cache, thumbnails  # noqa: F401
+        from .search import setup_search
+        post_migrate.connect(setup_search, sender=self)
@@ -0,0 +1,4 @@
+from .data import (cover_image, fill_books, fill_store,  # noqa: F401
+                   fill_users)
+from .timing import (format_timings, max_rss, measure,  # noqa: F401
+                     private_caches, rollback, summary)
@@ -0,0 +1,173 @@
+import os
+import random
+from contextlib import contextmanager
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from PIL import Image
+from sorl.thumbnail import delete
+
+from books.models import Book, Genre
+from users.models import CustomUser, Order, OrderLine, Review, ViewedGenres
+
+COVER = 'books/benchmark.jpg'
+WORDS = [
+    'война', 'мир', 'тайна', 'море', 'город', 'ночь', 'звезда', 'дорога',
+    'сердце', 'время', 'история', 'огонь', 'остров', 'тень', 'солнце',
+    'память', 'путь', 'лес', 'зима', 'дом', 'небо', 'сказка', 'правда',
+    'голос', 'зеркало', 'север', 'ветер', 'мастер', 'сад', 'письмо',
+]
+NAMES = [
+    'Иван', 'Анна', 'Петр', 'Мария', 'Лев', 'Ольга', 'Федор', 'Елена',
+    'Антон', 'Нина', 'Михаил', 'Вера', 'Сергей', 'Ирина', 'Борис',
+]
+COMMENTS = [
+    'Отличная книга', 'Читается на одном дыхании', 'Не понравилось',
+    'Советую всем', 'Слишком длинно', 'Перечитаю еще раз',
+]
+SURNAMES = [
+    'Толстой', 'Чехов', 'Пушкин', 'Гоголь', 'Бунин', 'Булгаков', 'Блок',
+    'Лермонтов', 'Тургенев', 'Куприн', 'Набоков', 'Платонов', 'Шолохов',
+]
+
+
+@contextmanager
+def cover_image():
+    """
+    Обложка книг для замеров, чтобы шаблоны строили настоящие миниатюры.
+    Созданная обложка удаляется вместе с миниатюрами после замеров.
+    """
+    created = not default_storage.exists(COVER)
+    if created:
+        path = default_storage.path(COVER)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (600, 900), '#123C69').save(path)
+    try:
+        yield COVER
+    finally:
+        if created:
+            delete(COVER)
+
+
+def fill_books(count, genres=20, seed=0, batch_size=2000):
+    """
+    Заполнение БД случайными книгами для замеров.
+    Каждой книге назначается от одного до трех жанров.
+    """
+    rnd = random.Random(seed)
+    genre_ids = [
+        genre.id for genre in Genre.objects.bulk_create(
+            Genre(name=f'Жанр {index}') for index in range(genres)
+        )
+    ]
+    through = Book.genre.through
+    for start in range(0, count, batch_size):
+        books = Book.objects.bulk_create(
+            Book(
+                name=' '.join(rnd.sample(WORDS, rnd.randint(1, 3))).title(),
+                author=f'{rnd.choice(NAMES)} {rnd.choice(SURNAMES)}',
+                description='Описание',
+                fragment='Отрывок',
+                pages=rnd.randint(50, 900),
+                main_image=COVER,
+                buying=rnd.randint(0, 1000),
+                price=rnd.randint(100, 3000),
+                score=rnd.randint(0, 5),
+                release=rnd.randint(1900, 2024),
+            )
+            for _ in range(min(batch_size, count - start))
+        )
+        through.objects.bulk_create(
+            through(book_id=book.id, genre_id=genre_id)
+            for book in books
+            for genre_id in rnd.sample(genre_ids, rnd.randint(1, 3))
+        )
+    return genre_ids
+
+
+def sample(rnd, items, low, high):
+    return rnd.sample(items, min(len(items), rnd.randint(low, high)))
+
+
+def fill_users(count, book_ids, genre_ids, seed=0, batch_size=1000):
+    """
+    Заполнение БД случайными пользователями для замеров:
+    корзина и закрытые заказы со строками и купленными книгами,
+    избранное, отзывы и просмотры жанров.
+    Счетчики отзывов книг и буферы жанров пересчитываются командами
+    recount_reviews и rebuild_viewed_genres.
+    """
+    rnd = random.Random(seed)
+    password = make_password('benchmark')
+    users = CustomUser.objects.bulk_create(
+        (CustomUser(username=f'benchmark-{seed}-{index}',
+                    email=f'benchmark-{seed}-{index}@example.com',
+                    password=password)
+         for index in range(count)),
+        batch_size=batch_size
+    )
+    closed_orders = Order.objects.bulk_create(
+        Order(user=user, close=True,
+              close_data=date.today() - timedelta(days=rnd.randint(0, 365)))
+        for user in users for _ in range(rnd.randint(0, 3))
+    )
+    carts = Order.objects.bulk_create(Order(user=user) for user in users)
+    prices = dict(Book.objects.filter(id__in=book_ids).values_list(
+        'id', 'final_price'
+    ))
+    order_books, lines, buyed = [], [], set()
+    for order in closed_orders + carts:
+        for book_id in sample(rnd, book_ids, 1 if order.close else 0, 4):
+            order_books.append(Order.book.through(
+                order_id=order.id, book_id=book_id
+            ))
+            if order.close:
+                lines.append(OrderLine(
+                    order=order, book_id=book_id, name=str(book_id),
+                    price=prices[book_id]
+                ))
+                buyed.add((order.user_id, book_id))
+    Order.book.through.objects.bulk_create(order_books, batch_size=batch_size)
+    OrderLine.objects.bulk_create(lines, batch_size=batch_size)
+    CustomUser.buyed_books.through.objects.bulk_create(
+        (CustomUser.buyed_books.through(customuser_id=user_id, book_id=book_id)
+         for user_id, book_id in buyed),
+        batch_size=batch_size
+    )
+    CustomUser.favorite_books.through.objects.bulk_create(
+        (CustomUser.favorite_books.through(customuser_id=user.id,
+                                           book_id=book_id)
+         for user in users for book_id in sample(rnd, book_ids, 0, 10)),
+        batch_size=batch_size
+    )
+    Review.objects.bulk_create(
+        (Review(user=user, book_id=book_id, score=rnd.randint(1, 5),
+                comment=rnd.choice(COMMENTS))
+         for user in users for book_id in sample(rnd, book_ids, 0, 5)),
+        batch_size=batch_size
+    )
+    ViewedGenres.objects.bulk_create(
+        (ViewedGenres(user=user, genre_id=rnd.choice(genre_ids))
+         for user in users for _ in range(rnd.randint(0, 30))),
+        batch_size=batch_size
+    )
+    for command in ('recount_reviews', 'rebuild_viewed_genres'):
+        call_command(command, stdout=StringIO())
+    return users
+
+
+def fill_store(books, users, genres=20, seed=0):
+    """
+    Книги, жанры и пользователи с заказами, отзывами и просмотрами,
+    похожие книги для рекомендаций рассчитываются build_similar.
+    """
+    genre_ids = fill_books(books, genres, seed)
+    book_ids = list(Book.objects.filter(
+        genre__in=genre_ids
+    ).values_list('id', flat=True).distinct())
+    users = fill_users(users, book_ids, genre_ids, seed)
+    call_command('build_similar', stdout=StringIO())
+    return genre_ids, book_ids, users
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .timing import summary
+from users.tracking import view_tracker
+
+HOLD_VIEWS = 24 * 60 * 60
+
+
+def scenarios(book_id, genre_ids, search_word='война'):
+    """
+    Сценарии замера страниц: имя -> (авторизация, метод, адрес, данные).
+    Фильтр каталога и поиск отправляются формой, как со страницы.
+    """
+    filters = {
+        'apply_filter': '', 'sort': 'min_final_price', 'genre_mode': 'any',
+        'genres': genre_ids[:2], 'pricemin': '300', 'pricemax': '2000',
+    }
+    pages = {
+        'index': ('get', reverse('books:index'), {}),
+        'catalog': ('get', reverse('books:catalog'), {}),
+        'catalog_filter': ('post', reverse('books:catalog'), filters),
+        'news': ('get', reverse('books:news'), {}),
+        'search': ('post', reverse('books:search'),
+                   {'search_word': search_word}),
+        'book': ('get', reverse('books:book', args=[book_id]), {}),
+    }
+    my_pages = {
+        'favorite': ('get', reverse('users:favorite'), {}),
+        'cart': ('get', reverse('users:cart'), {}),
+        'library': ('get', reverse('users:library'), {}),
+        'profile': ('get', reverse('users:profile'), {}),
+    }
+    return {
+        **{f'anonymous:{name}': (False, *page)
+           for name, page in pages.items()},
+        **{f'user:{name}': (True, *page)
+           for name, page in {**pages, **my_pages}.items()},
+    }
+
+
+@contextmanager
+def held_views():
+    """
+    Просмотры жанров со страницы книги остаются в буфере view_tracker
+    до конца замеров: фоновый поток не пишет их в БД отдельным
+    соединением, пока данные замера не зафиксированы.
+    Оставшиеся в очереди события записываются flush() внутри
+    транзакции замера и откатываются вместе с ней, уже забранные
+    потоком теряются с остановкой процесса.
+    """
+    interval, batch = view_tracker.flush_interval, view_tracker.batch_size
+    view_tracker.flush_interval = view_tracker.batch_size = HOLD_VIEWS
+    try:
+        yield
+    finally:
+        view_tracker.flush()
+        view_tracker.flush_interval, view_tracker.batch_size = interval, batch
+
+
+def run_scenario(client, scenario, repeat):
+    """
+    Первый запрос прогревает кеши, затем repeat замеров.
+    Возвращает время ответа (min, p50, p95, max в миллисекундах)
+    и наибольшее число SQL запросов на один ответ.
+    """
+    _, method, url, data = scenario
+    send = getattr(client, method)
+
+    def request():
+        response = send(url, data)
+        if response.status_code != 200:
+            raise AssertionError(f'{url}: ответ {response.status_code}')
+
+    request()
+    timings, queries = [], 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, len(captured))
+    return {'queries': queries, **summary(timings)}
+
+
+def run_scenarios(scenarios, user, repeat):
+    """Анонимные сценарии без сессии, авторизованные - от имени user"""
+    clients = {False: Client(), True: Client()}
+    clients[True].force_login(user)
+    with held_views():
+        return {
+            name: run_scenario(clients[scenario[0]], scenario, repeat)
+            for name, scenario in scenarios.items()
+        }
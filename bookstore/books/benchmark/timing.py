@@ -0,0 +1,86 @@
+import sys
+import time
+from contextlib import contextmanager
+from statistics import quantiles
+
+from django.conf import settings
+from django.db import transaction
+from django.test import override_settings
+
+try:
+    import resource
+except ImportError:
+    # Windows: пик RSS не измеряется
+    resource = None
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rollback():
+    """Все изменения БД внутри блока откатываются после замеров"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def private_caches():
+    """
+    Кеши в памяти процесса вместо настроенных на время замеров:
+    слайдеры, счетчики фильтров и карточки синтетических книг
+    не попадают в кеши работающего сайта.
+    """
+    return override_settings(CACHES={
+        alias: {
+            **config,
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'benchmark:{alias}',
+        }
+        for alias, config in settings.CACHES.items()
+    })
+
+
+def max_rss():
+    """
+    Пиковый RSS процесса в байтах (ru_maxrss в Linux - в килобайтах,
+    в macOS - в байтах), None без модуля resource.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def summary(timings):
+    """min, p50, p95, max списка времен в миллисекундах"""
+    percentiles = (
+        quantiles(timings, n=100, method='inclusive')
+        if len(timings) > 1 else timings * 99
+    )
+    return {
+        'min': min(timings),
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'max': max(timings),
+    }
+
+
+def measure(func, repeat=20):
+    """Время выполнения func в миллисекундах: min, p50, p95, max"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summary(timings)
+
+
+def format_timings(name, timings):
+    return f'{name:<30}' + ''.join(
+        f'{key}={value:9.2f}ms ' for key, value in timings.items()
+    )
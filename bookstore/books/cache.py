@@ -0,0 +1,136 @@
+import time
+from datetime import date, timedelta
+from itertools import zip_longest
+
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Banner, Book, Event, SimilarBooks
+from bookstore.settings import (MAX_BOOKS_ON_SLIDER, NEWBOOK_DAYS,
+                                RECOMMENDER_USER_SEEDS, SLIDERS_CACHE_TIMEOUT)
+
+SLIDERS_CACHE_KEY = 'books:sliders'
+BOOKS_DELETED_CACHE_KEY = 'books:deleted'
+
+
+def books_ids(books_list, count=MAX_BOOKS_ON_SLIDER):
+    return list(books_list.values_list('id', flat=True)[:count])
+
+
+def get_sliders():
+    """
+    Данные слайдеров главной: id книг и баннеры.
+    Хранятся в кеше до изменения книг, баннеров или акций.
+    """
+    sliders = cache.get(SLIDERS_CACHE_KEY)
+    if sliders is None:
+        new = Book.objects.filter(
+            created__gte=date.today() - timedelta(days=NEWBOOK_DAYS))
+        if not new.exists():
+            new = Book.objects.order_by('created')
+        sliders = {
+            'popular': books_ids(Book.objects.order_by('-buying')),
+            'new': books_ids(new),
+            'recomended': books_ids(Book.objects.order_by('-score')),
+            'banners': list(Banner.objects.filter(close=False)),
+        }
+        cache.set(SLIDERS_CACHE_KEY, sliders, SLIDERS_CACHE_TIMEOUT)
+    return sliders
+
+
+def books_deleted():
+    """
+    Метка последнего удаления книг: удаление не меняет updated_at
+    оставшихся книг. Если метки нет в кеше (первый запуск или
+    вытеснение), записывается новая, поэтому старые ETag не совпадут.
+    """
+    return cache.get_or_set(BOOKS_DELETED_CACHE_KEY, time.time_ns, None)
+
+
+def user_recomended_ids(user, recomended):
+    """
+    Рекомендации пользователя: популярные книги его любимого жанра,
+    затем книги с высокой оценкой. Выбирается не больше
+    MAX_BOOKS_ON_SLIDER книг, без загрузки всего списка.
+    """
+    genre_ids = books_ids(Book.objects.filter(
+        genre=user.most_viewed_genres).order_by('-buying'))
+    missing = MAX_BOOKS_ON_SLIDER - len(genre_ids)
+    if not missing:
+        return genre_ids
+    rest = [book_id for book_id in recomended if book_id not in genre_ids]
+    if len(rest) < missing:
+        rest = books_ids(
+            Book.objects.exclude(id__in=genre_ids).order_by('-score'),
+            missing
+        )
+    return genre_ids + rest[:missing]
+
+
+def similar_ids(book_id):
+    """Похожие книги ("С этой книгой покупают") одной выборкой по ключу"""
+    return SimilarBooks.objects.filter(book_id=book_id).values_list(
+        'ids', flat=True
+    ).first() or []
+
+
+def user_similar_ids(user, fallback):
+    """
+    Рекомендации по книгам, похожим на последние купленные и избранные
+    пользователем. Списки похожих книг чередуются, уже купленные
+    пропускаются, недостающие места занимаются книгами из fallback.
+    """
+    seeds = []
+    for field in ('buyed_books', 'favorite_books'):
+        seeds += getattr(user, field).through.objects.filter(
+            customuser=user
+        ).order_by('-id').values_list(
+            'book_id', flat=True
+        )[:RECOMMENDER_USER_SEEDS]
+    seeds = list(dict.fromkeys(seeds))
+    lists = SimilarBooks.objects.in_bulk(seeds)
+    candidates = [
+        book_id
+        for ids in zip_longest(*(lists[seed].ids for seed in seeds
+                                 if seed in lists))
+        for book_id in ids if book_id is not None
+    ]
+    skip = set(seeds) | set(user.buyed_books.filter(
+        id__in=candidates
+    ).values_list('id', flat=True))
+    ids = []
+    for book_id in candidates + list(fallback):
+        if book_id not in skip:
+            skip.add(book_id)
+            ids.append(book_id)
+    return ids[:MAX_BOOKS_ON_SLIDER]
+
+
+def books_by_ids(*ids_lists):
+    """Книги для нескольких списков id одним запросом с сохранением порядка"""
+    books = Book.objects.in_bulk(
+        {book_id for ids in ids_lists for book_id in ids}
+    )
+    return [
+        [books[book_id] for book_id in ids if book_id in books]
+        for ids in ids_lists
+    ]
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(m2m_changed, sender=Event.books.through)
+def clear_sliders(**kwargs):
+    """Сброс кеша слайдеров при изменении книг, баннеров и акций"""
+    cache.delete(SLIDERS_CACHE_KEY)
+
+
+@receiver(post_delete, sender=Book)
+def mark_books_deleted(**kwargs):
+    """Новая метка удаления книг для ETag страниц каталога"""
+    cache.set(BOOKS_DELETED_CACHE_KEY, time.time_ns(), None)
@@ -0,0 +1,72 @@
+import hashlib
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Max
+from django.views.decorators.http import condition
+
+from .cache import books_deleted, get_sliders, similar_ids
+from .models import Book
+
+
+def catalog_state(request):
+    """
+    Время последнего изменения книг (по индексу updated_at) и метка
+    последнего удаления книг из кеша, один раз на запрос страницы.
+    """
+    if not hasattr(request, '_catalog_state'):
+        request._catalog_state = {
+            **Book.objects.aggregate(updated=Max('updated_at')),
+            'deleted': books_deleted(),
+        }
+    return request._catalog_state
+
+
+def is_cacheable(request):
+    """Общие для всех страницы: анонимный GET без форм фильтров"""
+    return (request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated)
+
+
+def sliders_state(request, *args, **kwargs):
+    """Главная: состав слайдеров и баннеров из кеша"""
+    sliders = get_sliders()
+    return [sliders['popular'], sliders['new'], sliders['recomended'],
+            [(banner.id, banner.image.name) for banner in sliders['banners']]]
+
+
+def news_state(request, *args, **kwargs):
+    """Новинки: книга перестает быть новой со сменой даты"""
+    return date.today()
+
+
+def book_state(request, book_id, *args, **kwargs):
+    """Страница книги: список похожих книг"""
+    return similar_ids(book_id)
+
+
+def conditional_page(*states):
+    """
+    Ответ 304 Not Modified анонимным посетителям, если с прошлого
+    визита книги не менялись. ETag строится из времени последнего
+    изменения книг, адреса с параметрами, CSRF cookie (токен встроен
+    в формы входа и регистрации страницы и меняется при входе)
+    и состояний страницы states (функции с аргументами view).
+    Last-Modified не отдается: по одной дате не видны ни states,
+    ни смена CSRF cookie.
+    Основные запросы и рендеринг шаблона при этом не выполняются.
+    Авторизованным страница собирается всегда: в ней избранное,
+    корзина и рекомендации пользователя.
+    """
+    def etag(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return None
+        state = catalog_state(request)
+        parts = [request.get_full_path(), state['updated'], state['deleted'],
+                 request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+                 *(func(request, *args, **kwargs) for func in states)]
+        return hashlib.md5(
+            repr(parts).encode(), usedforsecurity=False
+        ).hexdigest()
+
+    return condition(etag_func=etag)
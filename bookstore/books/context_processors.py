@@ -0,0 +1,27 @@
+from django.contrib.auth.forms import AuthenticationForm
+from django.utils.functional import SimpleLazyObject
+
+from .forms import SearchForm
+from users.cart import get_cart_count
+from users.forms import SignupForm
+
+
+def main_forms(request):
+    """
+    Формы и состояние корзины для шапки, используются на всех страницах.
+    Форма регистрации и количество книг в корзине вычисляются
+    только если шаблон к ним обращается.
+    """
+    user = request.user
+    cart_count = SimpleLazyObject(
+        lambda: get_cart_count(user) if user.is_authenticated else 0
+    )
+    return {
+        'search_form': SearchForm,
+        'auth_form': AuthenticationForm,
+        'signup_form': SimpleLazyObject(
+            lambda: SignupForm(auto_id='signup_%s')
+        ),
+        'cart_count': cart_count,
+        'order_full': SimpleLazyObject(lambda: bool(cart_count)),
+    }
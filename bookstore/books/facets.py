@@ -0,0 +1,87 @@
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import Book, Genre
+from bookstore.settings import FACETS_CACHE_TIMEOUT, PRICE_FACETS
+
+
+def genre_counts(books_list):
+    """Количество книг по жанрам одним GROUP BY по таблице связей"""
+    return dict(
+        Book.genre.through.objects.filter(
+            book_id__in=books_list.order_by().values('id')
+        ).values('genre_id').annotate(
+            count=Count('*')
+        ).values_list('genre_id', 'count')
+    )
+
+
+def price_counts(books_list):
+    """Количество книг по диапазонам цены со скидкой из PRICE_FACETS"""
+    bounds = list(PRICE_FACETS)
+    bucket = Case(
+        *[
+            When(final_price__lt=bound, then=Value(index))
+            for index, bound in enumerate(bounds[1:])
+        ],
+        default=Value(len(bounds) - 1),
+        output_field=IntegerField()
+    )
+    counts = dict(
+        books_list.order_by().annotate(bucket=bucket).values('bucket')
+        .annotate(count=Count('id')).values_list('bucket', 'count')
+    )
+    return [
+        {
+            'min': bound,
+            'max': bounds[index + 1] - 1 if index + 1 < len(bounds) else '',
+            'count': counts.get(index, 0),
+        }
+        for index, bound in enumerate(bounds)
+    ]
+
+
+def year_counts(books_list):
+    """Количество книг по десятилетиям выхода"""
+    counts = books_list.order_by().annotate(
+        decade=F('release') / 10 * 10
+    ).values('decade').annotate(
+        count=Count('id')
+    ).values_list('decade', 'count')
+    return [
+        {'min': decade, 'max': decade + 9, 'count': count}
+        for decade, count in sorted(counts)
+    ]
+
+
+def compute_facets(books_list):
+    if books_list.query.is_empty():
+        return {'genres': {}, 'prices': [], 'years': []}
+    return {
+        'genres': genre_counts(books_list),
+        'prices': price_counts(books_list),
+        'years': year_counts(books_list),
+    }
+
+
+def get_facets(books_list):
+    """
+    Фасеты для текущей выборки книг: жанры, цены и годы выхода.
+    Кешируются по SQL выборки на FACETS_CACHE_TIMEOUT секунд.
+    """
+    if books_list.query.is_empty():
+        facets = compute_facets(books_list)
+    else:
+        key = 'books:facets:' + md5(
+            str(books_list.order_by().query).encode()
+        ).hexdigest()
+        facets = cache.get(key)
+        if facets is None:
+            facets = compute_facets(books_list)
+            cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    genres = list(Genre.objects.all())
+    for genre in genres:
+        genre.count = facets['genres'].get(genre.id, 0)
+    return genres, facets
@@ -0,0 +1,251 @@
+import csv
+import json
+import os
+from io import BytesIO
+from itertools import count, islice, repeat
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from . import validator as val
+from .models import Book, BookFiles, Genre
+from .storage import book_files_storage
+from .thumbnails import THUMBNAILS, warm_image
+from bookstore.settings import IMPORT_COVER_MAX_SIZE
+
+FIELDS = ('author', 'name', 'description', 'fragment')
+NUMBER_FIELDS = ('pages', 'release', 'price')
+FORMATS = [name for name, _ in BookFiles._meta.get_field('name').choices]
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path, file_format=None):
+    """
+    Строки CSV (заголовок - имена полей) или JSONL по одной,
+    без чтения всего файла. Возвращает пары (номер строки, словарь).
+    Вместо словаря нечитаемой строки (ошибка CSV или JSON) - RowError:
+    она попадает в отчет, а импорт продолжается. Байты не в UTF-8
+    не прерывают чтение, такие строки отклоняет parse_row.
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.')
+    with open(path, 'rb') as file:
+        lines = (line.decode('utf-8', 'surrogateescape') for line in file)
+        if file_format == 'csv':
+            reader = csv.DictReader(lines)
+            for number in count(1):
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as error:
+                    row = RowError(f'ошибка CSV: {error}')
+                yield number, row
+        else:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    row = RowError(f'ошибка JSON: {error}')
+                yield number, row
+
+
+def split(value):
+    """Список из JSON массива или строки 'a; b; c'"""
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in (value or '').split(';') if item.strip()]
+
+
+def file_format(path):
+    """Формат файла книги по расширению: book.ios.epub -> IOS.EPUB"""
+    name = os.path.basename(path).upper()
+    for book_format in sorted(FORMATS, key=len, reverse=True):
+        if name.endswith(f'.{book_format}'):
+            return book_format
+    raise RowError(f'неизвестный формат файла {path}')
+
+
+def clean_fields(model, values):
+    """
+    Значения полей через валидаторы модели (длина, диапазон чисел),
+    как в админке: иначе ошибку дал бы только INSERT всей пачки.
+    """
+    cleaned, errors = {}, []
+    for field, value in values.items():
+        try:
+            cleaned[field] = model._meta.get_field(field).clean(value, None)
+        except ValidationError as error:
+            errors.append(f'{field}: {" ".join(error.messages)}')
+    if errors:
+        raise RowError('; '.join(errors))
+    return cleaned
+
+
+def parse_row(row, base_dir):
+    """Проверка строки и приведение типов, ошибки - RowError"""
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('строка не объект JSON')
+    try:
+        json.dumps(row, ensure_ascii=False).encode('utf-8')
+    except UnicodeEncodeError:
+        raise RowError('строка не в кодировке UTF-8')
+    missing = [field for field in (*FIELDS, *NUMBER_FIELDS, 'cover')
+               if not str(row.get(field) or '').strip()]
+    if missing:
+        raise RowError(f'нет полей {", ".join(missing)}')
+    values = clean_fields(Book, {
+        **{field: str(row[field]).strip() for field in FIELDS},
+        **{field: row[field] for field in NUMBER_FIELDS},
+    })
+    genres = split(row.get('genres'))
+    genre_name = Genre._meta.get_field('name')
+    for name in genres:
+        try:
+            genre_name.clean(name, None)
+        except ValidationError as error:
+            raise RowError(f'genres: {" ".join(error.messages)}')
+    files = [os.path.join(base_dir, path) for path in split(row.get('files'))]
+    return {
+        'book': {field: values[field] for field in FIELDS},
+        'numbers': {field: values[field] for field in NUMBER_FIELDS},
+        'genres': genres,
+        'cover': os.path.join(base_dir, str(row['cover']).strip()),
+        'files': [(file_format(path), path) for path in files],
+    }
+
+
+def parse_rows(rows, base_dir, on_error):
+    """Проверенные строки, ошибочные передаются в on_error(номер, ошибка)"""
+    for number, row in rows:
+        try:
+            yield number, parse_row(row, base_dir)
+        except RowError as error:
+            on_error(number, str(error))
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class GenreMap:
+    """Id жанров по названию, недостающие жанры создаются"""
+
+    def __init__(self):
+        self.ids = dict(Genre.objects.values_list('name', 'id'))
+
+    def resolve(self, names):
+        missing = {name for name in names if name not in self.ids}
+        if missing:
+            for genre in Genre.objects.bulk_create(
+                Genre(name=name) for name in missing
+            ):
+                self.ids[genre.name] = genre.id
+        return [self.ids[name] for name in names]
+
+
+def store_cover(book, path):
+    """
+    Обложка в хранилище: изображение проверяется, слишком большое
+    уменьшается до IMPORT_COVER_MAX_SIZE, остальные копируются как есть.
+    """
+    name = val.book_image_directory_path(book, os.path.basename(path))
+    with Image.open(path) as image:
+        image_format = image.format
+        if max(image.size) <= IMPORT_COVER_MAX_SIZE:
+            image.verify()
+            with open(path, 'rb') as file:
+                return default_storage.save(name, File(file))
+        image.thumbnail((IMPORT_COVER_MAX_SIZE, IMPORT_COVER_MAX_SIZE))
+        buffer = BytesIO()
+        image.save(buffer, format=image_format)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def store_media(book_id, cover, files):
+    """
+    Задача пула процессов: обложка и копирование файлов книги.
+    Только файловая система, без записи в БД: основной процесс держит
+    транзакцию пачки, и SQLite заблокировал бы запись из процессов пула.
+    Возвращает (id книги, обложка, [(формат, файл)], ошибка).
+    """
+    book = Book(id=book_id)
+    try:
+        cover_name = store_cover(book, cover)
+        stored = []
+        for book_format, path in files:
+            with open(path, 'rb') as file:
+                stored.append((book_format, book_files_storage.save(
+                    val.book_directory_path(
+                        BookFiles(book=book), os.path.basename(path)
+                    ), File(file)
+                )))
+    except (OSError, Image.DecompressionBombError) as error:
+        return book_id, None, [], f'{type(error).__name__}: {error}'
+    return book_id, cover_name, stored, None
+
+
+def import_batch(batch, genres, executor, chunksize=4):
+    """
+    Одна пачка строк одной транзакцией: книги и связи с жанрами
+    bulk_create, обложки и файлы в пуле процессов, затем bulk_update
+    обложек и bulk_create файлов. Книги с ошибкой медиа удаляются.
+    При прерывании транзакция откатывается и пачка импортируется
+    заново, скопированные файлы такой пачки остаются в хранилище.
+    Возвращает (обложки созданных книг, [(номер строки, ошибка)]).
+    """
+    with transaction.atomic():
+        books = Book.objects.bulk_create(
+            Book(**row['book'], **row['numbers']) for _, row in batch
+        )
+        through = Book.genre.through
+        through.objects.bulk_create(
+            through(book_id=book.id, genre_id=genre_id)
+            for book, (_, row) in zip(books, batch)
+            for genre_id in set(genres.resolve(row['genres']))
+        )
+        results = executor.map(
+            store_media,
+            [book.id for book in books],
+            [row['cover'] for _, row in batch],
+            [row['files'] for _, row in batch],
+            chunksize=chunksize
+        )
+        lines = {book.id: number for book, (number, _) in zip(books, batch)}
+        by_id = {book.id: book for book in books}
+        errors, failed, files, covers = [], [], [], []
+        for book_id, cover, stored, error in results:
+            if error:
+                errors.append((lines[book_id], error))
+                failed.append(book_id)
+                continue
+            by_id[book_id].main_image.name = cover
+            covers.append(cover)
+            files += [BookFiles(book_id=book_id, name=name, file=path)
+                      for name, path in stored]
+        Book.objects.filter(id__in=failed).delete()
+        Book.objects.bulk_update(
+            [book for book in books if book.id not in failed],
+            ['main_image']
+        )
+        BookFiles.objects.bulk_create(files)
+    return covers, errors
+
+
+def warm_covers(covers, executor, chunksize=4):
+    """Миниатюры обложек пачки в пуле после фиксации транзакции"""
+    return sum(executor.map(
+        warm_image, covers, repeat(THUMBNAILS[Book][1]), chunksize=chunksize
+    ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+
+from books.benchmark import (cover_image, fill_books, format_timings, measure,
+                             rollback)
+from books.models import Book
+
+INCLUDE = ("{% for book in books %}"
+           "{% include 'books/includes/catalog_card.html' %}"
+           "{% endfor %}")
+CARDS = ("{% load cards %}{% book_cards books 'catalog' as cards %}"
+         "{% for card in cards %}{{ card }}{% endfor %}")
+
+
+class Command(BaseCommand):
+    help = ('Замер рендеринга карточек каталога: include на каждую книгу '
+            'против карточек из кеша')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+',
+                            default=[100, 1000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        """
+        Карточки удаленных после замера книг остаются в кеше до истечения
+        CARD_CACHE_TIMEOUT, ключ включает updated_at и с новыми книгами
+        не совпадет.
+        """
+        engine = Engine.get_default()
+        include, cards = engine.from_string(INCLUDE), engine.from_string(CARDS)
+        with cover_image(), rollback():
+            fill_books(max(options['counts']))
+            for count in options['counts']:
+                books = list(Book.objects.order_by('id')[:count])
+                context = {
+                    'books': books,
+                    'favorite_books': [book.id for book in books[::3]],
+                    'csrf_token': 'token',
+                }
+                # Первый проход создает миниатюры и заполняет кеш
+                include.render(Context(context))
+                cards.render(Context(context))
+                self.stdout.write(format_timings(
+                    f'{count} карточек, include',
+                    measure(lambda: include.render(Context(context)),
+                            options['repeat'])
+                ))
+                self.stdout.write(format_timings(
+                    f'{count} карточек, кеш',
+                    measure(lambda: cards.render(Context(context)),
+                            options['repeat'])
+                ))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.benchmark import fill_books, rollback
+from books.models import Book, Event, apply_event
+
+
+class Command(BaseCommand):
+    help = 'Замер применения и удаления акции на весь каталог'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def check_discount(self, event, discount):
+        if Book.objects.filter(event=event, discount__lt=discount).exists():
+            raise CommandError(f'Не у всех книг скидка {discount}%')
+
+    def handle(self, *args, **options):
+        with rollback():
+            fill_books(options['books'])
+            self.stdout.write(f'Книг в каталоге: {Book.objects.count()}')
+            base = Event.objects.create(event_on='all_books', discount=10)
+            apply_event(base)
+            for discount in range(20, 20 + options['repeat'] * 5, 5):
+                start = time.perf_counter()
+                event = Event.objects.create(
+                    event_on='all_books', discount=discount
+                )
+                apply_event(event)
+                applied = time.perf_counter() - start
+                self.check_discount(base, discount)
+
+                start = time.perf_counter()
+                event.delete()
+                deleted = time.perf_counter() - start
+                self.check_discount(base, base.discount)
+                self.stdout.write(
+                    f'Скидка {discount}%: применение {applied * 1000:.0f}ms, '
+                    f'удаление {deleted * 1000:.0f}ms'
+                )
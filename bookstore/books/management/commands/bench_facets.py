@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from books.benchmark import fill_books, format_timings, measure, rollback
+from books.facets import compute_facets
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Замер подсчета фасетов фильтров на синтетическом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with rollback():
+            genre_ids = fill_books(options['books'])
+            self.stdout.write(f'Книг в каталоге: {Book.objects.count()}')
+            selections = {
+                'весь каталог': Book.objects.all(),
+                'цена 300-999': Book.objects.filter(
+                    final_price__range=(300, 999)),
+                'один жанр': Book.objects.filter(genre=genre_ids[0]),
+            }
+            for name, books_list in selections.items():
+                self.stdout.write(format_timings(
+                    name,
+                    measure(lambda: compute_facets(books_list),
+                            options['repeat'])
+                ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import get_thumbnail
+
+from books.models import Banner, Book
+from books.thumbnails import CARD_FACTORS, CROP, FACTORS, WEBP, scale
+
+SAMPLES = [
+    ('карточка каталога', Book, 'main_image', '221x240'),
+    ('слайдер главной', Book, 'main_image', 'x240'),
+    ('баннер', Banner, 'image', '1200x300'),
+]
+
+
+def size(image, geometry, options):
+    thumbnail = get_thumbnail(image, geometry, **options)
+    return thumbnail.storage.size(thumbnail.name)
+
+
+class Command(BaseCommand):
+    help = ('Сравнение объема изображений: одна миниатюра в исходном '
+            'формате против WebP вариантов тега {% picture %}')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100)
+
+    def handle(self, *args, **options):
+        for title, model, field, geometry in SAMPLES:
+            images = [
+                getattr(item, field)
+                for item in model.objects.exclude(
+                    **{field: ''}
+                )[:options['limit']]
+            ]
+            if not images:
+                continue
+            factors = FACTORS.get(geometry, CARD_FACTORS)
+            before = sum(size(image, geometry, CROP) for image in images)
+            self.stdout.write(
+                f'{title} ({len(images)} шт.): было {before / 1024:.0f} КБ'
+            )
+            for factor in factors:
+                after = sum(
+                    size(image, scale(geometry, factor), {**CROP, **WEBP})
+                    for image in images
+                )
+                self.stdout.write(
+                    f'    WebP {scale(geometry, factor)}: '
+                    f'{after / 1024:.0f} КБ ({after / before:.0%})'
+                )
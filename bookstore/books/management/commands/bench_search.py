@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from books.benchmark import fill_books, format_timings, measure, rollback
+from books.models import Book
+from books.search import search_books
+from bookstore.settings import MAX_BOOKS_ON_PAGE
+
+QUERIES = ['война', 'тайна острова', 'Булгаков', 'звезд', 'неттакогослова']
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости поиска книг на синтетическом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rollback():
+            fill_books(options['books'])
+            self.stdout.write(f'Книг в каталоге: {Book.objects.count()}')
+            for word in QUERIES:
+                self.stdout.write(format_timings(
+                    f'search "{word}"',
+                    measure(lambda: list(search_books(
+                        Book.objects.all(), word
+                    )[:MAX_BOOKS_ON_PAGE]), options['repeat'])
+                ))
+                self.stdout.write(format_timings(
+                    f'iregex "{word}"',
+                    measure(lambda: list(Book.objects.filter(
+                        Q(name__iregex=word) | Q(author__iregex=word)
+                    ).order_by('-buying')[:MAX_BOOKS_ON_PAGE]),
+                        options['repeat'])
+                ))
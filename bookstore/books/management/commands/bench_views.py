@@ -0,0 +1,142 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from books.benchmark import (cover_image, fill_store, format_timings,
+                             private_caches, rollback)
+from books.benchmark.scenarios import run_scenarios, scenarios
+from books.models import Book
+from users.models import CustomUser
+
+BASELINE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    'benchmark', 'baseline.json'
+)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Сценарии хуже базовых значений: больше SQL запросов на ответ
+    или медиана времени ответа выше базовой в tolerance раз.
+    """
+    errors = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            errors.append(f'{name}: запросов {result["queries"]}, '
+                          f'базовое значение {base["queries"]}')
+        if result['p50'] > base['p50'] * tolerance:
+            errors.append(f'{name}: p50 {result["p50"]:.2f}ms, '
+                          f'базовое значение {base["p50"]:.2f}ms')
+    return errors
+
+
+class Command(BaseCommand):
+    help = ('Замер страниц магазина тестовым клиентом Django на '
+            'синтетических данных: время ответа и число SQL запросов. '
+            'С --check сравнивается с сохраненными базовыми значениями')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--scenario', action='append', default=[],
+            help='Начало имени сценария, например user: или anonymous:book'
+        )
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Записать результаты как базовые для текущей СУБД'
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Ошибка, если результаты хуже базовых для текущей СУБД'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=1.5,
+            help='Во сколько раз медиана времени может превышать базовую'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Данные создаются в транзакции и откатываются после замеров.
+        Базовые значения хранятся отдельно для каждой СУБД
+        (connection.vendor): число запросов переносимо между машинами,
+        время ответа - только между запусками на одной машине.
+        Кеши на время замеров подменяются кешами в памяти процесса
+        (private_caches), общие кеши сайта не меняются.
+        """
+        vendor = connection.vendor
+        with private_caches(), cover_image(), rollback():
+            genre_ids, book_ids, users = fill_store(
+                options['books'], options['users'], seed=options['seed']
+            )
+            book = Book.objects.filter(id__in=book_ids).order_by(
+                '-buying', 'id'
+            ).first()
+            user = CustomUser.objects.filter(
+                id__in=[user.id for user in users]
+            ).annotate(books=Count('buyed_books')).order_by(
+                '-books', 'id'
+            ).first()
+            selected = {
+                name: scenario
+                for name, scenario in scenarios(book.id, genre_ids).items()
+                if not options['scenario'] or any(
+                    name.startswith(prefix) for prefix in options['scenario']
+                )
+            }
+            if not selected:
+                raise CommandError('Нет сценариев с таким именем')
+            self.stdout.write(
+                f'{vendor}: книг {len(book_ids)}, пользователей {len(users)}'
+            )
+            results = run_scenarios(selected, user, options['repeat'])
+
+        for name, result in results.items():
+            timings = {key: value for key, value in result.items()
+                       if key != 'queries'}
+            self.stdout.write(
+                f'{format_timings(name, timings)}запросов={result["queries"]}'
+            )
+
+        baseline = load_baseline(options['baseline'])
+        if options['save_baseline']:
+            baseline.setdefault(vendor, {}).update({
+                name: {
+                    'queries': result['queries'],
+                    'p50': round(result['p50'], 2),
+                    'p95': round(result['p95'], 2),
+                }
+                for name, result in results.items()
+            })
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(baseline, file, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+                file.write('\n')
+            self.stdout.write(f'Базовые значения записаны: {vendor}')
+        if options['check']:
+            if vendor not in baseline:
+                raise CommandError(f'Нет базовых значений для {vendor}')
+            errors = regressions(
+                results, baseline[vendor], options['tolerance']
+            )
+            if errors:
+                raise CommandError(
+                    'Регрессия производительности:\n' + '\n'.join(errors)
+                )
+            self.stdout.write('Результаты не хуже базовых')
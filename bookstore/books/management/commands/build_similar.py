@@ -0,0 +1,52 @@
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from books.recommender import build_similar, save_similar, top_similar
+from bookstore.settings import MAX_BOOKS_ON_SLIDER
+
+
+class Command(BaseCommand):
+    help = ('Расчет похожих книг по покупкам, избранному и просмотрам '
+            'жанров для блоков "С этой книгой покупают" и рекомендаций')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=MAX_BOOKS_ON_SLIDER)
+        parser.add_argument(
+            '--synthetic', type=int, nargs=2, metavar=('BOOKS', 'ACTIONS'),
+            help='Замер на случайных данных без записи в БД, '
+                 'например --synthetic 100000 1000000'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def synthetic(self, books, actions, seed):
+        """Покупки с популярностью книг по закону Ципфа"""
+        rnd = np.random.default_rng(seed)
+        popularity = 1 / np.arange(1, books + 1) ** 0.8
+        return (
+            rnd.integers(0, max(actions // 10, 1), actions),
+            rnd.choice(books, actions, p=popularity / popularity.sum()),
+            np.ones(actions, dtype=np.float32),
+        )
+
+    def handle(self, *args, **options):
+        tracemalloc.start()
+        start = time.perf_counter()
+        if options['synthetic']:
+            similar = top_similar(
+                *self.synthetic(*options['synthetic'], options['seed']),
+                count=options['count']
+            )
+        else:
+            similar = build_similar(options['count'])
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if not options['synthetic']:
+            save_similar(similar)
+        self.stdout.write(
+            f'Книг с похожими: {len(similar)}, расчет {elapsed:.2f}с, '
+            f'пик памяти {peak / 2 ** 20:.1f} МБ'
+        )
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from books.benchmark import max_rss
+from books.cache import clear_sliders
+from books.importer import (GenreMap, batches, import_batch, parse_rows,
+                            read_rows, warm_covers)
+from books.thumbnails import init_worker
+from bookstore.settings import IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Импорт книг из CSV или JSONL (author, name, description, '
+            'fragment, pages, release, price, genres, cover, files) '
+            'пачками с продолжением после прерывания')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--base-dir',
+                            help='Откуда считаются пути обложек и файлов, '
+                                 'по умолчанию папка source')
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Процессов, по умолчанию по числу ядер')
+        parser.add_argument('--no-thumbnails', action='store_true')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать сначала, а не с сохраненной строки')
+
+    def error(self, number, error):
+        self.errors += 1
+        self.stderr.write(f'Строка {number}: {error}')
+
+    def handle(self, *args, **options):
+        """
+        Строки читаются генератором и импортируются пачками, в памяти
+        одна пачка. После каждой пачки номер последней строки
+        записывается в <source>.progress, повторный запуск продолжает
+        с нее. Файл удаляется после успешного импорта.
+        """
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f'Файл {source} не найден')
+        progress = f'{source}.progress'
+        start_line = 0
+        if os.path.exists(progress) and not options['restart']:
+            with open(progress) as file:
+                start_line = json.load(file)['line']
+            self.stdout.write(f'Продолжение со строки {start_line + 1}')
+        base_dir = options['base_dir'] or os.path.dirname(
+            os.path.abspath(source)
+        )
+        rows = parse_rows(
+            ((number, row) for number, row in read_rows(
+                source, options['format']
+            ) if number > start_line),
+            base_dir, self.error
+        )
+        genres = GenreMap()
+        self.errors = created = thumbnails = 0
+        start = time.perf_counter()
+        connections.close_all()
+        with ProcessPoolExecutor(options['workers'],
+                                 initializer=init_worker) as executor:
+            for batch in batches(rows, options['batch_size']):
+                covers, errors = import_batch(batch, genres, executor)
+                for number, error in errors:
+                    self.error(number, error)
+                with open(progress, 'w') as file:
+                    json.dump({'line': batch[-1][0]}, file)
+                created += len(covers)
+                if not options['no_thumbnails']:
+                    thumbnails += warm_covers(covers, executor)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'Строка {batch[-1][0]}: книг {created}, '
+                    f'{created / elapsed:.0f} книг/с'
+                )
+        clear_sliders()
+        if os.path.exists(progress):
+            os.remove(progress)
+        elapsed = time.perf_counter() - start
+        rss = max_rss()
+        memory = f', пик памяти {rss / 2 ** 20:.0f} МБ' if rss else ''
+        self.stdout.write(
+            f'Импортировано книг: {created}, миниатюр: {thumbnails}, '
+            f'ошибок: {self.errors}\n'
+            f'{elapsed:.2f}с, {created / elapsed:.0f} книг/с{memory}'
+        )
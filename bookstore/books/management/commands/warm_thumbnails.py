@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.thumbnails import warm_all
+
+
+class Command(BaseCommand):
+    help = ('Создание миниатюр обложек книг и баннеров заранее, '
+            'чтобы страницы не ресайзили изображения при рендеринге')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Процессов, по умолчанию по числу ядер')
+        parser.add_argument('--chunksize', type=int, default=8)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        images, created = warm_all(options['workers'], options['chunksize'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'Изображений: {images}, создано миниатюр: {created}, '
+            f'{elapsed:.2f}с, {images / elapsed:.1f} изображений/с'
+        )
@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Now
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.dispatch import receiver
 from django.db.models.signals import pre_delete, m2m_changed
 
 import books.validator as val
+from books.storage import book_files_storage
 
 event_choise = [('books', 'Книги'), ('genres', 'Жанры'),
                 ('all_books', 'Все')]
@@ -83,6 +86,7 @@ class BookFiles(models.Model):
     file = models.FileField(
         unique=True,
         upload_to=val.book_directory_path,
+        storage=book_files_storage,
         validators=[val.validate_file]
     )
 
@@ -139,6 +143,11 @@ class Book(models.Model):
             MinValueValidator(0)
         ]
     )
+    final_price = models.GeneratedField(
+        expression=F('price') * (100 - F('discount')) / 100,
+        output_field=models.PositiveIntegerField('Цена книги со скидкой'),
+        db_persist=True,
+    )
     score = models.PositiveIntegerField(
         'Оценка книги',
         help_text='Оценка товара',
@@ -148,6 +157,14 @@ class Book(models.Model):
             MinValueValidator(0)
         ]
     )
+    review_count = models.PositiveIntegerField(
+        'Количество отзывов',
+        default=0
+    )
+    review_sum = models.PositiveIntegerField(
+        'Сумма оценок отзывов',
+        default=0
+    )
     release = models.PositiveIntegerField(
         'Дата выпуска книги',
         validators=[
@@ -160,39 +177,75 @@ class Book(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения книги',
+        auto_now=True,
+        db_index=True,
+    )
 
     class Meta:
         ordering = ('-created', )
+        indexes = [
+            models.Index(
+                fields=['final_price', 'id'], name='book_final_price_idx'
+            ),
+        ]
         verbose_name = 'Книга'
         verbose_name_plural = 'Книги'
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating(self):
+        """Точная средняя оценка по отзывам"""
+        if not self.review_count:
+            return 0
+        return self.review_sum / self.review_count
+
+    def save(self, *args, **kwargs):
+        """
+        final_price считается в БД, а Django 5.0 не обновляет
+        GeneratedField после save(), поэтому цена перечитывается.
+        """
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['final_price'])
+
     def get_price(self):
-        return int(self.price * ((100 - self.discount)/100))
+        """Цена со скидкой считается в БД (final_price)"""
+        return self.final_price
 
     @receiver(pre_delete, sender=Event)
     def delete_event(sender, instance, **kwargs):
         """
-        При удалении скидки проверяется:
-        Если других скидок у книги нет - скидка у книги = 0
-        Если у книги скидки выше чем у удаляемой, то ничего не меняется
-        Если у книги скидки ниже то идет поиск самой высокой и ставится она.
+        При удалении скидки книгам акции пересчитывается скидка
+        по оставшимся акциям (наибольшая или 0).
         """
-        books = instance.books.all()
-        for book in books:
-            book.event.remove(instance)
-            book_events = book.event.all()
-            new_discount = 0
-            for event in book_events:
-                if instance.discount < event.discount:
-                    new_discount = book.discount
-                    break
-                if new_discount < event.discount:
-                    new_discount = event.discount
-            book.discount = new_discount
-            book.save()
+        recalculate_discounts(
+            Book.objects.filter(event=instance), exclude_event=instance
+        )
+
+
+class SimilarBooks(models.Model):
+    """Похожие книги, рассчитываются командой build_similar"""
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='similar',
+        verbose_name='Книга',
+    )
+    ids = models.JSONField(
+        'id похожих книг',
+        default=list,
+    )
+
+    class Meta:
+        verbose_name = 'Похожие книги'
+        verbose_name_plural = 'Похожие книги'
+
+    def __str__(self):
+        return str(self.book_id)
 
 
 class Banner(models.Model):
@@ -215,18 +268,69 @@ class Banner(models.Model):
         return 'Не показывается' if self.close else 'Показывается'
 
 
-def book_event_change(instance, action, pk_set, **kwargs):
+def recalculate_discounts(books, exclude_event=None):
+    """
+    Пересчет скидки книг одним UPDATE:
+    скидка книги = наибольшая скидка ее акций, 0 если акций нет.
+    exclude_event - акция, которая не учитывается (удаляемая).
+    """
+    events = Event.books.through.objects.filter(book=OuterRef('pk'))
+    if exclude_event is not None:
+        events = events.exclude(event=exclude_event)
+    max_discount = events.order_by().values('book').annotate(
+        max_discount=Max('event__discount')
+    ).values('max_discount')
+    with transaction.atomic():
+        return books.update(
+            discount=Coalesce(Subquery(max_discount), Value(0)),
+            updated_at=Now()
+        )
+
+
+def raise_discounts(event):
+    """Книгам акции ставится ее скидка, если у книги нет большей"""
+    with transaction.atomic():
+        return Book.objects.filter(
+            event=event, discount__lt=event.discount
+        ).update(discount=event.discount, updated_at=Now())
+
+
+def apply_event(event):
+    """
+    Привязка акции на жанры или на все книги.
+    Связи создаются одним INSERT ... SELECT без загрузки книг в память,
+    затем скидки выставляются одним UPDATE.
+    """
+    books = Book.objects.exclude(event=event)
+    if event.event_on == 'genres':
+        books = books.filter(genre__in=event.genres.all())
+    query = books.order_by().values('id').distinct().query
+    sql, params = query.sql_with_params()
+    through = Event.books.through._meta
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {through.db_table} '
+            f'({through.get_field("event").column}, '
+            f'{through.get_field("book").column}) '
+            f'SELECT %s, books.id FROM ({sql}) books',
+            (event.id, *params)
+        )
+        raise_discounts(event)
+
+
+def book_event_change(instance, action, reverse, pk_set, **kwargs):
     """
-    При создании m2m модели между акцией и книгой устанавливается скидка,
-    если у книги нет большей скидки.
+    При изменении связей акции и книг скидки пересчитываются
+    набором UPDATE запросов, а не сохранением каждой книги.
     """
-    if action == "post_add":
-        copy_pk_set = pk_set.copy()
-        while copy_pk_set:
-            book = Book.objects.get(id=copy_pk_set.pop())
-            if book.discount < instance.discount:
-                book.discount = instance.discount
-            book.save()
+    if action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        recalculate_discounts(Book.objects.filter(id=instance.id))
+    elif action == 'post_add':
+        raise_discounts(instance)
+    else:
+        recalculate_discounts(Book.objects.filter(id__in=pk_set))
 
 
 m2m_changed.connect(book_event_change, sender=Event.books.through)
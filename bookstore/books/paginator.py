@@ -0,0 +1,137 @@
+from datetime import date
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'books.paginator'
+
+
+class CursorPage:
+    """
+    Страница keyset-пагинации.
+    Вместо номера страницы хранит курсоры на соседние страницы,
+    поэтому не требует подсчета всех строк таблицы.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor='', previous_cursor='',
+                 has_next=False, has_previous=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    """
+    Keyset (seek) пагинация по ключу сортировки.
+    object_list - queryset книг,
+    ordering - поля сортировки, по умолчанию сортировка queryset,
+    per_page - количество объектов на странице.
+    Ко всем ключам добавляется id, чтобы порядок был однозначным.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None):
+        ordering = list(
+            ordering
+            or object_list.query.order_by
+            or object_list.model._meta.ordering
+        )
+        ordering = [key for key in ordering if key.lstrip('-') != 'id']
+        id_key = '-id' if ordering and ordering[-1].startswith('-') else 'id'
+        self.ordering = ordering + [id_key]
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def _encode(self, book, reverse):
+        values = []
+        for key in self.ordering:
+            value = getattr(book, key.lstrip('-'))
+            if isinstance(value, date):
+                value = value.isoformat()
+            values.append(value)
+        return signing.dumps(
+            {'o': self.ordering, 'k': values, 'r': reverse},
+            salt=CURSOR_SALT
+        )
+
+    def _decode(self, cursor):
+        """Неверный или устаревший курсор означает первую страницу"""
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if (data.get('o') != self.ordering
+                or len(data.get('k', [])) != len(self.ordering)):
+            return None
+        return data
+
+    def _seek(self, values, reverse):
+        """
+        Условие "строго после курсора" для лексикографического порядка:
+        (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+        """
+        condition = Q()
+        equal = {}
+        for key, value in zip(self.ordering, values):
+            field = key.lstrip('-')
+            descending = key.startswith('-') != reverse
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+        return condition
+
+    def _reversed_ordering(self):
+        return [
+            key[1:] if key.startswith('-') else '-' + key
+            for key in self.ordering
+        ]
+
+    def get_page(self, cursor=''):
+        data = self._decode(cursor)
+        reverse = bool(data and data['r'])
+        books = self.object_list.order_by(
+            *(self._reversed_ordering() if reverse else self.ordering)
+        )
+        if data:
+            books = books.filter(self._seek(data['k'], reverse))
+        books = list(books[:self.per_page + 1])
+        has_more = len(books) > self.per_page
+        books = books[:self.per_page]
+        if reverse:
+            books.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, data is not None
+        has_next = has_next and bool(books)
+        has_previous = has_previous and bool(books)
+        return CursorPage(
+            books,
+            next_cursor=self._encode(books[-1], False) if has_next else '',
+            previous_cursor=(
+                self._encode(books[0], True) if has_previous else ''
+            ),
+            has_next=has_next,
+            has_previous=has_previous,
+        )
@@ -0,0 +1,210 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Book, SimilarBooks
+from users.models import CustomUser, ViewedGenres
+from bookstore.settings import (MAX_BOOKS_ON_SLIDER, RECOMMENDER_BUY_WEIGHT,
+                                RECOMMENDER_CHUNK_PAIRS,
+                                RECOMMENDER_FAVORITE_WEIGHT,
+                                RECOMMENDER_MAX_USER_BOOKS)
+
+
+def group_starts(groups):
+    """Начало каждой строки в массиве, отсортированном по groups"""
+    starts = np.ones(len(groups), dtype=bool)
+    starts[1:] = groups[1:] != groups[:-1]
+    return np.flatnonzero(starts)
+
+
+def rank_in_groups(groups):
+    """Номер элемента внутри своей группы (groups отсортирован)"""
+    starts = group_starts(groups)
+    sizes = np.diff(np.append(starts, len(groups)))
+    return np.arange(len(groups)) - np.repeat(starts, sizes)
+
+
+def interactions(users, items, weights, max_items):
+    """
+    Разреженная матрица пользователь x объект в виде троек
+    (строка, столбец, вес), отсортированных по строке.
+    Повторы складываются, у пользователя остается не больше
+    max_items объектов с наибольшим весом.
+    """
+    item_ids, item_index = np.unique(items, return_inverse=True)
+    _, user_index = np.unique(users, return_inverse=True)
+    keys, inverse = np.unique(
+        user_index.astype(np.int64) * len(item_ids) + item_index,
+        return_inverse=True
+    )
+    weight = np.bincount(inverse, weights=weights).astype(np.float32)
+    rows, cols = keys // len(item_ids), keys % len(item_ids)
+    order = np.lexsort((-weight, rows))
+    rows, cols, weight = rows[order], cols[order], weight[order]
+    keep = rank_in_groups(rows) < max_items
+    return item_ids, rows[keep], cols[keep], weight[keep]
+
+
+def aggregate(keys, values):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=values)
+
+
+def cooccurrence(rows, cols, weight, size, chunk_pairs):
+    """
+    Матрица совместной встречаемости X.T @ X без диагонали.
+    Пары объектов одного пользователя строятся векторно, пачками
+    пользователей, чтобы в памяти было не больше chunk_pairs пар.
+    Возвращает ключи пар (i * size + j) и суммы весов.
+    """
+    starts = group_starts(rows)
+    sizes = np.diff(np.append(starts, len(rows)))
+    pairs = sizes.astype(np.int64) ** 2
+    chunks = group_starts((np.cumsum(pairs) - pairs) // chunk_pairs)
+    bounds = np.append(starts, len(rows))
+    parts_keys, parts_values = [], []
+    for first, last in zip(chunks, np.append(chunks[1:], len(starts))):
+        user_sizes = sizes[first:last]
+        element_size = np.repeat(user_sizes, user_sizes)
+        element_start = np.repeat(starts[first:last], user_sizes)
+        left = np.repeat(
+            np.arange(bounds[first], bounds[last]), element_size
+        )
+        offset = np.arange(len(left)) - np.repeat(
+            np.cumsum(element_size) - element_size, element_size
+        )
+        right = np.repeat(element_start, element_size) + offset
+        pair = left != right
+        left, right = left[pair], right[pair]
+        keys, values = aggregate(
+            cols[left].astype(np.int64) * size + cols[right],
+            weight[left] * weight[right]
+        )
+        parts_keys.append(keys)
+        parts_values.append(values)
+    if len(parts_keys) == 1:
+        return parts_keys[0], parts_values[0]
+    keys, values = np.concatenate(parts_keys), np.concatenate(parts_values)
+    del parts_keys, parts_values
+    return aggregate(keys, values)
+
+
+def top_similar(users, items, weights, count,
+                max_items=RECOMMENDER_MAX_USER_BOOKS,
+                chunk_pairs=RECOMMENDER_CHUNK_PAIRS):
+    """
+    Item-to-item рекомендации: для каждого объекта count объектов
+    с наибольшим косинусным сходством по совместной встречаемости.
+    users, items, weights - массивы взаимодействий одной длины.
+    Возвращает словарь {id объекта: [id похожих объектов]}.
+    """
+    if not len(items):
+        return {}
+    item_ids, rows, cols, weight = interactions(
+        users, items, weights, max_items
+    )
+    size = len(item_ids)
+    keys, values = cooccurrence(rows, cols, weight, size, chunk_pairs)
+    norm = np.sqrt(np.bincount(cols, weights=weight ** 2, minlength=size))
+    left = (keys // size).astype(np.int32)
+    right = (keys % size).astype(np.int32)
+    del keys
+    similarity = (values / (norm[left] * norm[right])).astype(np.float32)
+    del values
+    order = np.lexsort((-similarity, left))
+    left, right = left[order], right[order]
+    keep = rank_in_groups(left) < count
+    left, right = left[keep], right[keep]
+    starts = group_starts(left)
+    return {
+        int(item_id): neighbours.tolist()
+        for item_id, neighbours in zip(
+            item_ids[left[starts]],
+            np.split(item_ids[right], starts[1:])
+        )
+    }
+
+
+def values_array(queryset, *fields):
+    return np.array(
+        list(queryset.values_list(*fields)), dtype=np.int64
+    ).reshape(-1, len(fields))
+
+
+def load_book_interactions():
+    """Покупки и избранное: пользователь, книга, вес"""
+    parts = []
+    for field, weight in (('buyed_books', RECOMMENDER_BUY_WEIGHT),
+                          ('favorite_books', RECOMMENDER_FAVORITE_WEIGHT)):
+        through = getattr(CustomUser, field).through
+        pairs = values_array(through.objects.all(), 'customuser_id', 'book_id')
+        parts.append((pairs, np.full(len(pairs), weight, dtype=np.float32)))
+    pairs = np.concatenate([pairs for pairs, _ in parts])
+    weights = np.concatenate([weights for _, weights in parts])
+    return pairs[:, 0], pairs[:, 1], weights
+
+
+def load_genre_interactions():
+    """Просмотры жанров: пользователь, жанр, логарифм числа просмотров"""
+    rows = values_array(
+        ViewedGenres.objects.values('user', 'genre').annotate(
+            views=Count('id')
+        ).order_by(), 'user', 'genre', 'views'
+    )
+    return rows[:, 0], rows[:, 1], np.log1p(rows[:, 2]).astype(np.float32)
+
+
+def fill_from_genres(similar, count):
+    """
+    Книги без покупок и с малым числом соседей добираются
+    популярными книгами своих жанров и жанров, которые чаще всего
+    смотрят вместе с ними (по ViewedGenres).
+    """
+    similar_genres = top_similar(*load_genre_interactions(), count=3)
+    popular = {}
+    for genre_id, book_id in Book.genre.through.objects.order_by(
+        'genre_id', '-book__buying'
+    ).values_list('genre_id', 'book_id'):
+        genre_books = popular.setdefault(genre_id, [])
+        if len(genre_books) < count + 1:
+            genre_books.append(book_id)
+    book_genres = {}
+    for book_id, genre_id in Book.genre.through.objects.values_list(
+        'book_id', 'genre_id'
+    ):
+        book_genres.setdefault(book_id, []).append(genre_id)
+    for book_id, genres in book_genres.items():
+        ids = similar.setdefault(book_id, [])
+        if len(ids) >= count:
+            continue
+        genres = genres + [
+            similar_id for genre_id in genres
+            for similar_id in similar_genres.get(genre_id, [])
+        ]
+        seen = set(ids) | {book_id}
+        for genre_id in genres:
+            for candidate in popular.get(genre_id, []):
+                if candidate not in seen:
+                    seen.add(candidate)
+                    ids.append(candidate)
+            if len(ids) >= count:
+                break
+        del ids[count:]
+    return similar
+
+
+def build_similar(count=MAX_BOOKS_ON_SLIDER):
+    """Расчет похожих книг по покупкам, избранному и просмотрам жанров"""
+    similar = top_similar(*load_book_interactions(), count=count)
+    return fill_from_genres(similar, count)
+
+
+@transaction.atomic
+def save_similar(similar, batch_size=2000):
+    """Полная замена таблицы похожих книг"""
+    SimilarBooks.objects.all().delete()
+    SimilarBooks.objects.bulk_create(
+        (SimilarBooks(book_id=book_id, ids=ids)
+         for book_id, ids in similar.items() if ids),
+        batch_size=batch_size
+    )
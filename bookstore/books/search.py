@@ -0,0 +1,125 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'books_book_fts'
+
+# Выражения индексов совпадают с SQL, который строит SearchVector,
+# иначе планировщик PostgreSQL не сможет их использовать.
+POSTGRESQL_SETUP = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    *[
+        f'CREATE INDEX IF NOT EXISTS books_book_{field}_tsv_idx '
+        f'ON books_book USING gin (to_tsvector('
+        f"'{SEARCH_CONFIG}'::regconfig, COALESCE((\"{field}\")::text, '')))"
+        for field in ('name', 'author')
+    ],
+    *[
+        f'CREATE INDEX IF NOT EXISTS books_book_{field}_trgm_idx '
+        f'ON books_book USING gin ("{field}" gin_trgm_ops)'
+        for field in ('name', 'author')
+    ],
+]
+
+SQLITE_SETUP = [
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    "name, author, content='books_book', content_rowid='id', "
+    "tokenize='unicode61')",
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON books_book '
+    f'BEGIN INSERT INTO {FTS_TABLE}(rowid, name, author) '
+    'VALUES (new.id, new.name, new.author); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON books_book '
+    f'BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, author) '
+    "VALUES ('delete', old.id, old.name, old.author); END",
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au '
+    'AFTER UPDATE OF name, author ON books_book BEGIN '
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, author) '
+    "VALUES ('delete', old.id, old.name, old.author); "
+    f'INSERT INTO {FTS_TABLE}(rowid, name, author) '
+    'VALUES (new.id, new.name, new.author); END',
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def setup_search(using='default', **kwargs):
+    """
+    Создание поисковых индексов под текущую БД.
+    PostgreSQL - GIN индексы tsvector и pg_trgm,
+    SQLite - таблица FTS5 с триггерами синхронизации.
+    Вызывается после migrate, повторный вызов безопасен.
+    """
+    conn = connections[using]
+    if conn.vendor == 'postgresql':
+        statements = POSTGRESQL_SETUP
+    elif conn.vendor == 'sqlite':
+        statements = SQLITE_SETUP
+    else:
+        return
+    with conn.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def fts_available():
+    """Есть ли в SQLite таблица FTS5 (ее нет, если sqlite собран без FTS5)"""
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def fts_query(search_word, column=None):
+    """
+    Запрос FTS5 из слов пользователя.
+    Каждое слово берется в кавычки, поэтому спецсимволы не ломают запрос,
+    и ищется по префиксу.
+    """
+    words = re.findall(r'\w+', search_word)
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"*' for word in words)
+    return f'{column} : ({query})' if column else query
+
+
+def fts_match(query):
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (query,)
+    )
+
+
+def search_books(books_list, search_word):
+    """
+    Поиск книг по названию и автору одним запросом.
+    Добавляет аннотацию name_match: 1 - совпало название, 0 - только автор.
+    Сортировка: сначала совпадения по названию, затем по популярности.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            search_word, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        books_list = books_list.alias(
+            name_vector=SearchVector('name', config=SEARCH_CONFIG),
+            author_vector=SearchVector('author', config=SEARCH_CONFIG),
+        )
+        name_q = (Q(name_vector=query)
+                  | Q(name__trigram_word_similar=search_word))
+        author_q = (Q(author_vector=query)
+                    | Q(author__trigram_word_similar=search_word))
+    elif connection.vendor == 'sqlite' and fts_available():
+        if fts_query(search_word) is None:
+            return books_list.none()
+        name_q = Q(id__in=fts_match(fts_query(search_word, 'name')))
+        author_q = Q(id__in=fts_match(fts_query(search_word, 'author')))
+    else:
+        name_q = Q(name__icontains=search_word)
+        author_q = Q(author__icontains=search_word)
+
+    return books_list.filter(name_q | author_q).annotate(
+        name_match=Case(
+            When(name_q, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )
+    ).order_by('-name_match', '-buying')
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import cached_property
+
+
+class BookFilesStorage(FileSystemStorage):
+    """
+    Хранилище файлов книг в BOOK_FILES_ROOT: вне STATICFILES_DIRS
+    и MEDIA_ROOT, поэтому их не раздают ни staticfiles, ни маршруты
+    static/ и media/, ни nginx. Ссылок на файлы нет, их отдает
+    users:get_book после проверки покупки.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(
+            self._location, settings.BOOK_FILES_ROOT
+        )
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'BOOK_FILES_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+    def url(self, name):
+        raise ValueError('Файлы книг отдает только users:get_book')
+
+
+book_files_storage = BookFilesStorage()
@@ -0,0 +1,74 @@
+from django import template
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from bookstore.settings import CARD_CACHE_TIMEOUT
+
+register = template.Library()
+
+# Шаблоны карточек и их дополнительный контекст
+CARDS = {
+    'catalog': ('books/includes/catalog_card.html', {}),
+    'slider': ('books/includes/slider_card.html', {
+        'orientation': True, 'css_class': 'card-img-top'
+    }),
+    # Рекомендации на главной: без поворота по EXIF
+    'slider_original': ('books/includes/slider_card.html', {
+        'orientation': False, 'css_class': ''
+    }),
+}
+CSRF_PLACEHOLDER = 'csrf-token-placeholder'
+
+
+def card_key(card, book, favorite):
+    return (f'books:card:{card}:{book.id}:'
+            f'{book.updated_at.timestamp()}:{int(favorite)}')
+
+
+def favorite_ids(context):
+    """id избранных книг страницы, один раз на рендеринг шаблона"""
+    if 'favorite_ids' not in context.render_context:
+        context.render_context['favorite_ids'] = set(
+            context.get('favorite_books') or ()
+        )
+    return context.render_context['favorite_ids']
+
+
+def render_card(card, book, favorite):
+    name, extra = CARDS[card]
+    return render_to_string(name, {
+        **extra,
+        'book': book,
+        'book_favorite': int(favorite),
+        'csrf_token': CSRF_PLACEHOLDER,
+    })
+
+
+@register.simple_tag(takes_context=True)
+def book_cards(context, books, card='catalog'):
+    """
+    Карточки книг из кеша: {% book_cards page_obj 'catalog' as cards %}.
+    HTML хранится по id книги, времени ее изменения (updated_at)
+    и состоянию сердца избранного, поэтому изменение книги или акции
+    само выводит старую карточку из употребления. Готовые карточки
+    читаются одним get_many, недостающие записываются одним set_many
+    в кеш cards.
+    Пользовательская часть - CSRF токен формы избранного -
+    подставляется при выводе.
+    """
+    cache = caches['cards']
+    ids = favorite_ids(context)
+    items = [(book, book.id in ids) for book in books]
+    keys = [card_key(card, *item) for item in items]
+    cards = cache.get_many(keys)
+    missing = {
+        key: render_card(card, *item)
+        for key, item in zip(keys, items) if key not in cards
+    }
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    token = str(context.get('csrf_token', ''))
+    return [mark_safe(cards[key].replace(CSRF_PLACEHOLDER, token))
+            for key in keys]
@@ -0,0 +1,56 @@
+from django import template
+from django.utils.html import format_html
+from sorl.thumbnail import get_thumbnail
+
+from books.thumbnails import CARD_FACTORS, CROP, FACTORS, WEBP, scale
+
+register = template.Library()
+
+
+def srcset(thumbnails, factors, sizes):
+    """Ширины (при заданном sizes) или плотности экрана"""
+    return ', '.join(
+        f'{thumbnail.url} {thumbnail.width}w' if sizes
+        else f'{thumbnail.url} {factor}x'
+        for thumbnail, factor in zip(thumbnails, factors)
+    )
+
+
+@register.simple_tag
+def picture(image, geometry, sizes='', lazy=True, alt='', css_class='',
+            **options):
+    """
+    Адаптивное изображение: WebP для браузеров, которые его поддерживают,
+    и исходный формат для остальных, каждое в нескольких размерах.
+    {% picture book.main_image "221x240" %} - плотности 1x и 2x,
+    sizes="..." - набор по ширине, lazy=False - для первого экрана.
+    Параметры sorl по умолчанию crop="center" upscale=True.
+    """
+    if not image:
+        return ''
+    options = {**CROP, **options}
+    factors = FACTORS.get(geometry, CARD_FACTORS)
+    fallback = [
+        get_thumbnail(image, scale(geometry, factor), **options)
+        for factor in factors
+    ]
+    webp = [
+        get_thumbnail(image, scale(geometry, factor), **options, **WEBP)
+        for factor in factors
+    ]
+    main = fallback[factors.index(1)]
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}"{}>'
+        '<img src="{}" srcset="{}"{} width="{}" height="{}" alt="{}"'
+        ' class="{}" loading="{}" decoding="async"></picture>',
+        srcset(webp, factors, sizes),
+        format_html(' sizes="{}"', sizes) if sizes else '',
+        main.url,
+        srcset(fallback, factors, sizes),
+        format_html(' sizes="{}"', sizes) if sizes else '',
+        main.width,
+        main.height,
+        alt,
+        css_class,
+        'lazy' if lazy else 'eager',
+    )
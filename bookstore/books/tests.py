@@ -0,0 +1,209 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.views import serve
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from PIL import Image
+
+from books.benchmark import cover_image
+from books.models import Book, BookFiles
+from books.templatetags.cards import card_key
+from users.models import CustomUser
+
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def temporary_root(test, setting):
+    """Временная папка вместо папки из настроек на время теста"""
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root)
+    test.enterContext(override_settings(**{setting: root}))
+    return root
+
+
+class ConditionalPageTest(TestCase):
+    def setUp(self):
+        temporary_root(self, 'MEDIA_ROOT')
+        self.cover = self.enterContext(cover_image())
+        self.book = Book.objects.create(
+            name='Книга', author='Автор', description='Описание',
+            fragment='Отрывок', pages=100, main_image=self.cover,
+            price=100, release=2000
+        )
+        CustomUser.objects.create_user(
+            'reader', 'reader@example.com', 'password-12345'
+        )
+        self.client = Client(enforce_csrf_checks=True)
+
+    def visit(self, etag=None, status=200):
+        headers = {'if-none-match': etag} if etag else {}
+        response = self.client.get(reverse('books:catalog'), headers=headers)
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def login(self, page):
+        token = CSRF_RE.search(page.content.decode()).group(1)
+        return self.client.post(reverse('users:login'), {
+            'username': 'reader', 'password': 'password-12345',
+            'csrfmiddlewaretoken': token,
+        })
+
+    def test_repeat_visit_not_modified(self):
+        self.visit()
+        etag = self.visit()['ETag']
+        self.visit(etag, status=304)
+
+    def test_deleted_book_changes_etag(self):
+        """Удаление старой книги не меняет Max(updated_at), но меняет ETag"""
+        Book.objects.create(
+            name='Другая', author='Автор', description='Описание',
+            fragment='Отрывок', pages=100, main_image=self.cover,
+            price=100, release=2000
+        )
+        self.visit()
+        etag = self.visit()['ETag']
+        Book.objects.filter(id=self.book.id).delete()
+        self.assertNotEqual(self.visit(etag)['ETag'], etag)
+
+    def test_login_after_logout_and_revisit(self):
+        """Страница после выхода собирается заново с новым CSRF токеном"""
+        self.visit()
+        page = self.visit()
+        self.visit(page['ETag'], status=304)
+        self.assertEqual(self.login(page).status_code, 200)
+        self.client.get(reverse('users:logout'))
+        page = self.visit(page['ETag'])
+        self.assertEqual(self.login(page).status_code, 200)
+
+
+class CardCacheTest(TestCase):
+    def test_cards_in_own_cache(self):
+        """Карточки не занимают общий кеш default и не вытесняют его"""
+        temporary_root(self, 'MEDIA_ROOT')
+        book = Book.objects.create(
+            name='Книга', author='Автор', description='Описание',
+            fragment='Отрывок', pages=100,
+            main_image=self.enterContext(cover_image()),
+            price=100, release=2000
+        )
+        caches['cards'].clear()
+        self.client.get(reverse('books:catalog'))
+        key = card_key('catalog', book, False)
+        self.assertIsNotNone(caches['cards'].get(key))
+        self.assertIsNone(caches['default'].get(key))
+
+
+class ImportBooksTest(TransactionTestCase):
+    """Ошибочные строки ленты попадают в отчет, остальные импортируются"""
+
+    def setUp(self):
+        temporary_root(self, 'MEDIA_ROOT')
+        temporary_root(self, 'BOOK_FILES_ROOT')
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        Image.new('RGB', (60, 90)).save(
+            os.path.join(self.source, 'cover.jpg')
+        )
+
+    def row(self, **fields):
+        return json.dumps({
+            'author': 'Автор', 'name': 'Книга', 'description': 'Описание',
+            'fragment': 'Отрывок', 'pages': 100, 'release': 2000,
+            'price': 100, 'genres': ['Роман'], 'cover': 'cover.jpg',
+            **fields
+        }, ensure_ascii=False).encode()
+
+    def import_books(self, name, lines):
+        path = os.path.join(self.source, name)
+        with open(path, 'wb') as file:
+            file.write(b'\n'.join(lines) + b'\n')
+        errors = StringIO()
+        call_command('import_books', path, '--no-thumbnails',
+                     '--workers', '1', stdout=StringIO(), stderr=errors)
+        return [line.split(':')[0] for line in errors.getvalue().splitlines()]
+
+    def test_bad_jsonl_rows_skipped(self):
+        errors = self.import_books('books.jsonl', [
+            self.row(name='Первая'),
+            self.row(price=-5),
+            '{"name": "Оборванная'.encode(),
+            self.row(name='Н' * 201),
+            self.row(release=99),
+            self.row(genres=['Ж' * 201]),
+            self.row(name='X').replace(b'X', b'\xff'),
+            self.row(pages='сто'),
+            self.row(name='Последняя'),
+        ])
+        self.assertEqual(errors, [f'Строка {line}' for line in range(2, 9)])
+        self.assertEqual(
+            sorted(Book.objects.values_list('name', flat=True)),
+            ['Первая', 'Последняя']
+        )
+
+    def test_bad_csv_rows_skipped(self):
+        errors = self.import_books('books.csv', [
+            b'author,name,description,fragment,pages,release,price,cover',
+            'Автор,Первая,Описание,Отрывок,100,2000,100,cover.jpg'.encode(),
+            'Автор,Вторая,Описание,Отрывок,100,2000,-5,cover.jpg'.encode(),
+            b'Author,\xff,Description,Fragment,100,2000,100,cover.jpg',
+            'Автор,Последняя,Описание,Отрывок,100,2000,100,cover.jpg'.encode(),
+        ])
+        self.assertEqual(errors, ['Строка 2', 'Строка 3'])
+        self.assertEqual(
+            sorted(Book.objects.values_list('name', flat=True)),
+            ['Первая', 'Последняя']
+        )
+
+
+class BookPriceTest(TestCase):
+    def test_final_price_after_save(self):
+        book = Book.objects.create(
+            name='Книга', author='Автор', description='Описание',
+            fragment='Отрывок', pages=100, main_image='books/test.jpg',
+            price=100, release=2000
+        )
+        self.assertEqual(book.get_price(), 100)
+        book.discount = 50
+        book.save()
+        self.assertEqual(book.get_price(), 50)
+
+
+class BookFilesStorageTest(TestCase):
+    def setUp(self):
+        temporary_root(self, 'BOOK_FILES_ROOT')
+        book = Book.objects.create(
+            name='Книга', author='Автор', description='Описание',
+            fragment='Отрывок', pages=100, main_image='books/test.jpg',
+            price=100, release=2000
+        )
+        self.book_file = BookFiles(book=book, name='PDF')
+        self.book_file.file.save('book.pdf', ContentFile(b'%PDF book'))
+
+    def test_file_outside_public_roots(self):
+        path = self.book_file.file.path
+        self.assertTrue(os.path.exists(path))
+        for root in (*settings.STATICFILES_DIRS, settings.MEDIA_ROOT):
+            self.assertNotEqual(os.path.commonpath([path, root]), root)
+
+    @override_settings(DEBUG=True)
+    def test_static_media_url_not_found(self):
+        """Файл книги не отдается ни staticfiles, ни маршрутом media"""
+        name = f'media/{self.book_file.file.name}'
+        self.assertIsNone(finders.find(name))
+        request = RequestFactory().get(f'/{settings.STATIC_URL}{name}')
+        with self.assertRaises(Http404):
+            serve(request, name)
+        response = self.client.get(f'/{self.book_file.file.name}')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from .models import Banner, Book
+from users.jobs import enqueue, job
+from bookstore.settings import PICTURE_WEBP_QUALITY
+
+CROP = {'crop': 'center', 'upscale': True}
+WEBP = {'format': 'WEBP', 'quality': PICTURE_WEBP_QUALITY}
+CARD_FACTORS = (1, 2)  # Плотности экрана 1x и 2x для карточек
+BANNER_FACTORS = (0.5, 1)  # Ширины баннера для телефонов и компьютеров
+FACTORS = {'1200x300': BANNER_FACTORS}
+
+
+def scale(geometry, factor):
+    """Масштаб размера sorl: '221x240' и 2 -> '442x480', 'x240' -> 'x480'"""
+    return 'x'.join(
+        str(round(int(side) * factor)) if side else ''
+        for side in geometry.split('x')
+    )
+
+
+def variants(geometry, options):
+    """Миниатюры тега picture: исходный формат и WebP в каждом масштабе"""
+    return [
+        (scale(geometry, factor), {**options, **image_format})
+        for image_format in ({}, WEBP)
+        for factor in FACTORS.get(geometry, CARD_FACTORS)
+    ]
+
+
+# Размеры и параметры совпадают с тегами {% picture %} и {% thumbnail %}
+# в шаблонах, иначе sorl посчитает миниатюру другой и создаст ее
+# при рендеринге.
+THUMBNAILS = {
+    Book: ('main_image', [
+        *variants('221x240', CROP),
+        *variants('x240', CROP),
+        *variants('x240', {**CROP, 'orientation': False}),
+    ]),
+    Banner: ('image', variants('1200x300', CROP)),
+}
+
+
+def modified_time(image):
+    try:
+        return image.storage.get_modified_time(image.name)
+    except NotImplementedError:
+        return None
+
+
+def thumbnails(source):
+    """Миниатюры изображения, которые sorl записал в KV-store"""
+    keys = default.kvstore._get(source.key, identity='thumbnails') or []
+    return [
+        thumbnail for thumbnail in map(default.kvstore._get, keys)
+        if thumbnail
+    ]
+
+
+def is_stale(source):
+    """Есть миниатюры старше исходного изображения"""
+    source_time = modified_time(source)
+    if source_time is None:
+        return False
+    for thumbnail in thumbnails(source):
+        if not thumbnail.exists():
+            continue
+        thumbnail_time = modified_time(thumbnail)
+        if thumbnail_time is not None and thumbnail_time < source_time:
+            return True
+    return False
+
+
+def warm_image(name, sizes):
+    """
+    Создание недостающих миниатюр одного изображения.
+    Готовые и актуальные миниатюры sorl находит в KV-store и пропускает,
+    устаревшие удаляются и создаются заново.
+    Возвращает количество созданных миниатюр.
+    """
+    source = ImageFile(name)
+    if not source.exists():
+        return 0
+    if is_stale(source):
+        delete(name, delete_file=False)
+    before = len(thumbnails(source))
+    for geometry, options in sizes:
+        get_thumbnail(name, geometry, **options)
+    return len(thumbnails(source)) - before
+
+
+def image_tasks():
+    """Имена изображений книг и баннеров с нужными им размерами"""
+    for model, (field, sizes) in THUMBNAILS.items():
+        for name in model.objects.exclude(**{field: ''}).values_list(
+            field, flat=True
+        ).iterator():
+            yield name, sizes
+
+
+def init_worker():
+    django.setup()
+
+
+def warm_all(workers=None, chunksize=8):
+    """
+    Миниатюры всех изображений в пуле процессов.
+    Соединения с БД закрываются до запуска пула, чтобы процессы
+    не делили сокет родителя, и каждый открывает свое.
+    Возвращает (изображений, создано миниатюр).
+    """
+    names, sizes = [], []
+    for name, image_sizes in image_tasks():
+        names.append(name)
+        sizes.append(image_sizes)
+    connections.close_all()
+    with ProcessPoolExecutor(workers, initializer=init_worker) as executor:
+        created = sum(executor.map(
+            warm_image, names, sizes, chunksize=chunksize
+        ))
+    return len(names), created
+
+
+@job('warm_thumbnails')
+def warm_thumbnails(image, sizes):
+    warm_image(image, sizes)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Banner)
+def warm_on_save(sender, instance, **kwargs):
+    """
+    Миниатюры нового изображения создает воркер фоновых задач,
+    а не первый запрос страницы. Ключ задачи - имя файла, поэтому
+    сохранение без смены изображения новую задачу не ставит.
+    """
+    field, sizes = THUMBNAILS[sender]
+    name = getattr(instance, field).name
+    if name:
+        enqueue('warm_thumbnails', f'thumbnails-{name}',
+                image=name, sizes=sizes)
@@ -2,9 +2,14 @@ from django.core.exceptions import ValidationError
 import unidecode
 
 
+# Папка файлов книг в books.storage.BookFilesStorage, их отдает users:get_book
+BOOK_FILES_DIRECTORY = 'books_file'
+
+
 def book_directory_path(instance, filename):
     """Создание пути для файлов"""
-    return f'books_file/{instance.book.id}/{unidecode.unidecode(filename)}'
+    return (f'{BOOK_FILES_DIRECTORY}/{instance.book.id}/'
+            f'{unidecode.unidecode(filename)}')
 
 
 def book_image_directory_path(instance, filename):
@@ -1,35 +1,40 @@
 from django.template.response import TemplateResponse
-from django.db.models import Q, F
-from django.contrib.auth.decorators import login_required
-from django.contrib.auth.forms import AuthenticationForm
-from django.shortcuts import get_object_or_404
-from django.urls import reverse_lazy
+from django.shortcuts import (aget_object_or_404, get_object_or_404, redirect,
+                              render)
+from django.db.models import Count
 from datetime import timedelta, date
-from itertools import chain
 
-from .models import Book, Genre, Banner
+from .models import Book
+from .cache import (books_by_ids, get_sliders, similar_ids,
+                    user_recomended_ids, user_similar_ids)
+from .conditional import (book_state, conditional_page, news_state,
+                          sliders_state)
+from .facets import get_facets
 from .forms import SearchForm
-from users.models import Review, ViewedGenres
-from users.forms import SignupForm
-from bookstore.settings import NEWBOOK_DAYS, MAX_BOOKS_ON_SLIDER
+from .paginator import CursorPaginator
+from .search import search_books
+from users.models import Order, Review
+from users.cart import areset_cart_count
+from users.decorators import alogin_required
+from users.tracking import view_tracker
+from bookstore.settings import NEWBOOK_DAYS, MAX_BOOKS_ON_PAGE
 
 
-def main_forms(request, order_full=False):
-    """Формы ниже используется на всех страницах"""
-    user = request.user
-    search_form = SearchForm
-    auth_form = AuthenticationForm
-    signup_form = SignupForm(auto_id='signup_%s')
-    if user.is_authenticated:
-        order_full = user.order.get(close=False).book.all().exists()
-
-    forms = {
-        'search_form': search_form,
-        'auth_form': auth_form,
-        'signup_form': signup_form,
-        'order_full': order_full
-    }
-    return forms
+def genre_filter(genre_ids, match_all=True):
+    """
+    Подзапрос id книг с выбранными жанрами по таблице связей.
+    match_all - книга должна иметь все жанры (GROUP BY ... HAVING COUNT),
+    иначе хотя бы один из них.
+    Стоимость не растет с числом жанров, в отличие от join на каждый жанр.
+    """
+    books = Book.genre.through.objects.filter(
+        genre_id__in=genre_ids
+    ).values('book_id')
+    if match_all:
+        books = books.annotate(
+            genres_count=Count('genre_id')
+        ).filter(genres_count=len(genre_ids))
+    return books.values('book_id')
 
 
 def filter_books(books_list, data):
@@ -37,14 +42,15 @@ def filter_books(books_list, data):
     Фильтрация книг
     books_list - список книг,
     data - requst.POST из родительской функции.
+    genre_mode=any - книги с любым из жанров, иначе со всеми.
     """
     if data.getlist('genres'):
-        for search_genre in data.getlist('genres'):
-            books_list = books_list.filter(genre=search_genre)
+        books_list = books_list.filter(id__in=genre_filter(
+            set(map(int, data.getlist('genres'))),
+            data.get('genre_mode') != 'any'
+        ))
     if data.get('pricemin', '') or data.get('pricemax', ''):
-        books_list = books_list.annotate(
-            total_price=(F('price') * (100 - F('discount'))) / 100
-        ).filter(total_price__range=(
+        books_list = books_list.filter(final_price__range=(
             int(data['pricemin']) if data['pricemin'] else 0,
             int(data['pricemax']) if data['pricemax'] else 9999990
         ))
@@ -64,6 +70,8 @@ def catalog_type(request, books_list, sort, auth=False, favorite=False):
     sort - способ сортировки,
     auth - для родительской функции требуется авторизация (@login_required),
     favorite - список избранного = список книг
+    Книги выводятся постранично, страница задается курсором
+    из формы фильтров или GET параметра cursor.
     """
     data = request.POST
     user = request.user
@@ -72,13 +80,13 @@ def catalog_type(request, books_list, sort, auth=False, favorite=False):
     }
     favorite_books = []
     if (request.method == "POST"
-        and books_list
         and 'apply_filter' in data
             and sort):
         sort = data.get('sort', sort)
         books_list = filter_books(books_list, data)
         post_filter_dict = {
             'genres': list(map(int, data.getlist('genres'))),
+            'genre_mode': data.get('genre_mode', 'all'),
             'pricemin': data.get('pricemin', ''),
             'pricemax': data.get('pricemax', ''),
             'datemin': data.get('datemin', ''),
@@ -87,54 +95,54 @@ def catalog_type(request, books_list, sort, auth=False, favorite=False):
         filter_dict.update(post_filter_dict)
     if (not auth and user.is_authenticated) or auth:
         if favorite:
-            favorite_books = books_list
+            favorite_books = books_list.values_list('id', flat=True)
         else:
             favorite_books = user.favorite_books.all().values_list(
                 'id', flat=True)
-    if books_list and sort:
-        books_list = books_list.annotate(
-            total_price=(F('price') * (100 - F('discount'))) / 100
-        ).order_by(
-            '-' + sort[4:] if 'min_' in sort else sort
-        )
+    ordering = None
+    if sort:
+        ordering = ['-' + sort[4:] if 'min_' in sort else sort]
+    paginator = CursorPaginator(books_list, MAX_BOOKS_ON_PAGE, ordering)
+    page_obj = paginator.get_page(
+        data.get('cursor') or request.GET.get('cursor', '')
+    )
+
+    genres, facets = get_facets(books_list)
 
     context = {
-        'page_obj': books_list,
-        'genres': Genre.objects.all(),
+        'page_obj': page_obj,
+        'genres': genres,
+        'facets': facets,
         sort: 'active',
         'filter_dict': filter_dict,
         'favorite_books': favorite_books
     }
-    context.update(main_forms(request))
     return context
 
 
+@conditional_page(sliders_state)
 def index(request):
     """Главная"""
     user = request.user
-    popular = Book.objects.all().order_by(
-        '-buying')
-    new = Book.objects.filter(
-        created__gte=date.today() - timedelta(days=NEWBOOK_DAYS))
-    recomended = Book.objects.all().order_by('-score')
+    sliders = get_sliders()
+    recomended = sliders['recomended']
     favorite_books = None
-    if not new:
-        new = Book.objects.order_by('created')
     if user.is_authenticated:
         if user.viewed_genres:
-            user_recomended = popular.filter(genre=user.most_viewed_genres)
-            recomended = list(chain(user_recomended,
-                              recomended.difference(user_recomended)))
+            recomended = user_recomended_ids(user, recomended)
+        recomended = user_similar_ids(user, recomended)
         favorite_books = user.favorite_books.all().values_list('id', flat=True)
+    popular, new, recomended = books_by_ids(
+        sliders['popular'], sliders['new'], recomended
+    )
 
     context = {
-        'popular': popular[:MAX_BOOKS_ON_SLIDER],
-        'new': new[:MAX_BOOKS_ON_SLIDER],
-        'recomended': recomended[:MAX_BOOKS_ON_SLIDER],
-        'banners': Banner.objects.filter(close=False),
+        'popular': popular,
+        'new': new,
+        'recomended': recomended,
+        'banners': sliders['banners'],
         'favorite_books': favorite_books
     }
-    context.update(main_forms(request))
     return TemplateResponse(request, 'index.html', context)
 
 
@@ -146,22 +154,9 @@ def search(request, sort=''):
     books_list = Book.objects.all()
     sort = data.get('sort', '')
     if search_word:
-        if not sort:
-            books_name_list = Book.objects.filter(
-                name__iregex=search_word
-            ).order_by('-buying')
-            books_author_list = Book.objects.filter(
-                author__iregex=search_word
-            ).exclude(id__in=books_name_list.values('id')).order_by('-buying')
-            if 'apply_filter' in data:
-                books_name_list = filter_books(books_name_list, data)
-                books_author_list = filter_books(books_author_list, data)
-            books_list = list(chain(books_name_list, books_author_list))
-        else:
-            books_list = Book.objects.filter(
-                Q(author__iregex=search_word) |
-                Q(name__iregex=search_word)
-            )
+        books_list = search_books(books_list, search_word)
+        if not sort and 'apply_filter' in data:
+            books_list = filter_books(books_list, data)
         search_form = SearchForm(data=data)
 
     context = catalog_type(request, books_list, sort)
@@ -169,6 +164,7 @@ def search(request, sort=''):
     return TemplateResponse(request, 'books/search.html', context)
 
 
+@conditional_page()
 def catalog(request, sort='min_buying'):
     """Основной каталог"""
     books_list = Book.objects.all()
@@ -176,6 +172,7 @@ def catalog(request, sort='min_buying'):
     return TemplateResponse(request, 'books/catalog.html', context)
 
 
+@conditional_page(news_state)
 def news(request, sort='min_release'):
     """Каталог новых книг"""
     books_list = Book.objects.filter(
@@ -185,12 +182,14 @@ def news(request, sort='min_release'):
     return TemplateResponse(request, 'books/news.html', context)
 
 
+@conditional_page(book_state)
 def book_detail(
     request,
     book_id,
     book_status=0,
     book_favorite=0,
-    user_have_review=False
+    user_have_review=False,
+    favorite_books=None
 ):
     """Страница книги"""
     user = request.user
@@ -203,76 +202,104 @@ def book_detail(
         if not book_status:
             book_status = 1 if order.book.filter(id=book_id) else 0
         book_favorite = 1 if user.favorite_books.filter(id=book_id) else 0
-        for genre in book.genre.all():
-            ViewedGenres.objects.create(user=user, genre=genre)
+        view_tracker.track(
+            user.id, book.genre.values_list('id', flat=True)
+        )
         user_have_review = reviews.filter(user=user).exists()
+    similar = books_by_ids(similar_ids(book_id))[0]
+    if similar and user.is_authenticated:
+        favorite_books = user.favorite_books.values_list('id', flat=True)
 
     context = {
         'book': book,
+        'similar': similar,
+        'favorite_books': favorite_books,
         'book_status': book_status,
         'reviews': reviews,
         'book_favorite': book_favorite,
         'files_format': files_format,
         'user_have_review': user_have_review
     }
-    context.update(main_forms(request))
     return TemplateResponse(request, 'books/book_detail.html', context)
 
 
-@login_required
-def change_favorite(request, book_favorite=0):
-    """Добавление или удаление из избранного на карточках и странице товара"""
+async def atoggle(through, **fields):
+    """
+    Удаление связи, а если ее не было - создание. Два запроса вместо
+    проверки, выборки существующих связей в add/remove и записи.
+    Возвращает True, если связь создана.
+    """
+    deleted, _ = await through.objects.filter(**fields).adelete()
+    if not deleted:
+        await through.objects.abulk_create(
+            [through(**fields)], ignore_conflicts=True
+        )
+    return not deleted
+
+
+@alogin_required
+async def change_favorite(request, book_favorite=0):
+    """Добавление или удаление из избранного на карточках и странице товара.
+    Async view: запросы к БД идут через async ORM, шаблон рендерится
+    сразу (render, а не TemplateResponse, который рендерится в потоке).
+    Пользователь передается в контекст, чтобы шаблон не загружал
+    request.user синхронно"""
     if request.method == "POST":
-        user = request.user
-        book = get_object_or_404(Book, id=request.POST['book'])
-        favorite_books = user.favorite_books.all().filter(id=book.id)
-        if favorite_books:
-            user.favorite_books.remove(book)
-        else:
-            user.favorite_books.add(book)
+        user = await request.auser()
+        book = await aget_object_or_404(
+            Book.objects.only('id'), id=request.POST['book']
+        )
+        if await atoggle(user.favorite_books.through,
+                         customuser_id=user.id, book_id=book.id):
             book_favorite = 1
 
         context = {
+            'user': user,
             'book': book,
             'book_favorite': book_favorite,
         }
         if 'button' in request.POST:
-            return TemplateResponse(
+            return render(
                 request, 'dynamic_forms/favorite_button.html', context
             )
-        return TemplateResponse(
+        return render(
             request, 'dynamic_forms/favorite.html', context
         )
-    return reverse_lazy('books:index')
+    return redirect('books:index')
 
 
-@login_required
-def change_cart(request, book_status=0):
-    """Добавление или удаление из корзины на странице товара"""
+@alogin_required
+async def change_cart(request, book_status=0):
+    """Добавление или удаление из корзины на странице товара (async view)"""
     if request.method == "POST":
-        user = request.user
-        book = get_object_or_404(Book, id=request.POST['book'])
-        if user.buyed_books.filter(id=book.id):
+        user = await request.auser()
+        book = await aget_object_or_404(
+            Book.objects.only('id'), id=request.POST['book']
+        )
+        if await user.buyed_books.filter(id=book.id).aexists():
 
             context = {
+                'user': user,
                 'book': book,
                 'book_status': 2
             }
-            return TemplateResponse(
+            return render(
                 request, 'dynamic_forms/cart_button.html', context
             )
-        order = user.order.filter(close=False)[0]
-        if order.book.filter(id=book.id):
-            order.book.remove(book)
-        else:
+        order_id = await user.order.filter(close=False).values_list(
+            'id', flat=True
+        ).afirst()
+        if await atoggle(Order.book.through,
+                         order_id=order_id, book_id=book.id):
             book_status = 1
-            order.book.add(book)
+        await areset_cart_count(user)
 
         context = {
+            'user': user,
             'book': book,
             'book_status': book_status
         }
-        return TemplateResponse(
+        return render(
             request, 'dynamic_forms/cart_button.html', context
         )
-    return reverse_lazy('books:index')
+    return redirect('books:index')
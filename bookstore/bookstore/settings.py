@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'users',
     'books',
     'sorl.thumbnail',
@@ -43,6 +44,7 @@ ROOT_URLCONF = 'bookstore.urls'
 
 THUMBNAIL_COLORSPACE = None
 THUMBNAIL_PRESERVE_FORMAT = True
+PICTURE_WEBP_QUALITY = 80  # Качество WebP миниатюр тега {% picture %}
 
 TEMPLATES = [
     {
@@ -55,6 +57,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'books.context_processors.main_forms',
             ],
         },
     },
@@ -81,6 +84,31 @@ DATABASES = {
 #     }
 # }
 
+# Файловый кеш общий для всех процессов сервера,
+# поэтому сброс по сигналам виден каждому из них.
+# Платежи заглушки (payments) лежат отдельно: вытеснение записей
+# default при переполнении не должно терять их статусы.
+# Карточки книг (cards) - в памяти процесса: в ключе есть updated_at книги,
+# поэтому общий сброс им не нужен, а вытесняются самые старые карточки
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'payments': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'payments'),
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+    'cards': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cards',
+        # До шести карточек на книгу: три вида и состояние избранного
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -109,6 +137,7 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 STATIC_URL = 'static/'
 # STATIC_ROOT = os.path.join(BASE_DIR, 'static') Для сервера
 MEDIA_ROOT = os.path.join(STATICFILES_DIRS[0], 'media')
+BOOK_FILES_ROOT = os.path.join(BASE_DIR, 'private')  # Файлы книг вне static
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -120,7 +149,49 @@ LOGIN_URL = 'books:index'
 DOMEN = os.getenv('DOMEN', default='http://127.0.0.1:8000')
 NEWBOOK_DAYS = 7  # Спустя это количество дней книга не считается новой
 MAX_BOOKS_ON_SLIDER = 12  # Количество книг в слайдере на главной
+MAX_BOOKS_ON_PAGE = 24  # Количество книг на странице каталога
+SLIDERS_CACHE_TIMEOUT = 60 * 60  # Сколько секунд хранятся слайдеры главной
+CART_CACHE_TIMEOUT = 60 * 60  # Сколько секунд хранится размер корзины
+FACETS_CACHE_TIMEOUT = 5 * 60  # Сколько секунд хранятся счетчики фильтров
+CARD_CACHE_TIMEOUT = 24 * 60 * 60  # Сколько секунд хранятся карточки книг
+PRICE_FACETS = (0, 300, 500, 1000, 2000)  # Границы диапазонов цен в фильтрах
 MAX_ORDERS_PROFILE = 5  # Количество заказов в профиле на страницу
+MAX_VIEWED_GENRES = 20  # Сколько последних просмотренных жанров учитывается
+
+# Рекомендации (manage.py build_similar)
+RECOMMENDER_BUY_WEIGHT = 3  # Вес покупки книги
+RECOMMENDER_FAVORITE_WEIGHT = 1  # Вес добавления книги в избранное
+RECOMMENDER_MAX_USER_BOOKS = 200  # Сколько книг пользователя учитывается
+RECOMMENDER_CHUNK_PAIRS = 5_000_000  # Пар книг в памяти за один шаг расчета
+RECOMMENDER_USER_SEEDS = 5  # По скольким последним книгам подбираются похожие
+IMPORT_BATCH_SIZE = 500  # Книг в одной транзакции import_books
+IMPORT_COVER_MAX_SIZE = 1600  # Предел большей стороны обложки при импорте
+
+# Фоновая запись просмотров жанров
+VIEWS_BUFFER_SIZE = 10000  # Размер очереди, при переполнении события теряются
+VIEWS_FLUSH_INTERVAL = 5  # Раз в сколько секунд просмотры пишутся в БД
+VIEWS_BATCH_SIZE = 1000  # Максимум просмотров в одной записи
+
+# Фоновые задачи (manage.py run_jobs)
+JOBS_MAX_ATTEMPTS = 5  # Попыток до пометки задачи как ошибочной
+JOBS_RETRY_DELAY = 30  # Секунд до повтора, удваивается с каждой попыткой
+JOBS_LOCK_TIMEOUT = 10 * 60  # Через сколько секунд зависшая задача повторяется
+JOBS_POLL_INTERVAL = 2  # Раз в сколько секунд воркер проверяет очередь
+
+# Платежи: yookassa или stub (локальная заглушка для разработки и замеров)
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', default='yookassa')
+PAYMENT_STUB_DELAY = 0  # Задержка ответа заглушки в секундах
+# Откуда брать адрес отправителя уведомлений (за прокси - HTTP_X_REAL_IP)
+PAYMENT_IP_HEADER = os.getenv('PAYMENT_IP_HEADER', default='REMOTE_ADDR')
+PAYMENT_TIMEOUT = 10  # Таймаут запроса к шлюзу и ответов сверки, секунд
+PAYMENT_RECONCILE_WORKERS = 8  # Одновременных запросов к шлюзу при сверке
+PAYMENT_RECONCILE_BATCH = 100  # Заказов в одной пачке сверки
+
+# Отдача купленных файлов: пусто - Django (FileResponse с Range),
+# nginx - X-Accel-Redirect, sendfile - X-Sendfile (Apache, lighttpd)
+DOWNLOAD_ACCEL = os.getenv('DOWNLOAD_ACCEL', default='')
+DOWNLOAD_ACCEL_PREFIX = '/protected/'  # internal location на BOOK_FILES_ROOT
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Размер куска при сборке ZIP библиотеки
 
 # Настройка почты
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -1,23 +1,22 @@
 from django.conf import settings
 from django.views.static import serve as mediaserve
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path, re_path
 
+from users.downloads import media_serve
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('books.urls', namespace='books')),
     path('my/', include('users.urls', namespace='users')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-    )
-else:
+# Файлы книг доступны только через users:get_book после проверки покупки
+urlpatterns += [
+    re_path(f'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$', media_serve),
+]
+if not settings.DEBUG:
     urlpatterns += [
-        re_path(f'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$',
-                mediaserve, {'document_root': settings.MEDIA_ROOT}),
         re_path(f'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$',
                 mediaserve, {'document_root': settings.STATIC_ROOT}),
     ]
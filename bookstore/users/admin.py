@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import CustomUser, Order, Review, ViewedGenres
+from .models import (CustomUser, Job, Order, OrderLine, Review,
+                     ViewedGenres)
 
 
 @admin.register(CustomUser)
@@ -13,11 +14,22 @@ class ViewedGenresAdmin(admin.ModelAdmin):
     pass
 
 
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    pass
+    inlines = [OrderLineInline]
 
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key', 'status', 'attempts', 'run_after')
+    list_filter = ('status', 'name')
@@ -0,0 +1,39 @@
+from django.core.cache import cache
+
+from .models import Order
+from bookstore.settings import CART_CACHE_TIMEOUT
+
+
+def cart_cache_key(user_id):
+    return f'users:cart:{user_id}'
+
+
+def get_cart_count(user):
+    """Количество книг в корзине (незакрытом заказе), хранится в кеше"""
+    count = cache.get(cart_cache_key(user.id))
+    if count is None:
+        count = Order.book.through.objects.filter(
+            order__user=user, order__close=False
+        ).count()
+        cache.set(cart_cache_key(user.id), count, CART_CACHE_TIMEOUT)
+    return count
+
+
+async def aget_cart_count(user):
+    """get_cart_count для async view"""
+    count = await cache.aget(cart_cache_key(user.id))
+    if count is None:
+        count = await Order.book.through.objects.filter(
+            order__user=user, order__close=False
+        ).acount()
+        await cache.aset(cart_cache_key(user.id), count, CART_CACHE_TIMEOUT)
+    return count
+
+
+def reset_cart_count(user):
+    """Сброс после изменения корзины или оплаты"""
+    cache.delete(cart_cache_key(user.id))
+
+
+async def areset_cart_count(user):
+    await cache.adelete(cart_cache_key(user.id))
@@ -0,0 +1,19 @@
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+
+def alogin_required(view):
+    """
+    login_required для async view: пользователь загружается через
+    request.auser() без перехода в поток и запоминается в запросе,
+    повторный await request.auser() в view запросов не делает.
+    login_required в Django 5.0 async view не поддерживает.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
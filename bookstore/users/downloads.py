@@ -0,0 +1,205 @@
+import logging
+import os
+import posixpath
+import re
+import zipfile
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.http import content_disposition_header, http_date
+from django.views.static import serve
+
+from books.validator import BOOK_FILES_DIRECTORY
+from bookstore.settings import (DOWNLOAD_ACCEL, DOWNLOAD_ACCEL_PREFIX,
+                                DOWNLOAD_CHUNK_SIZE)
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Форматы, которые уже сжаты: в архив кладутся без повторного сжатия
+ZIP_STORED_EXTENSIONS = ('.pdf', '.epub', '.mobi', '.zip')
+
+
+class FileRange:
+    """
+    Часть файла для ответа 206.
+    Чтение ограничено диапазоном, а fileno() позволяет WSGI серверу
+    (gunicorn) отдать часть через os.sendfile: он начинает с текущей
+    позиции файла и отправляет Content-Length байт.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def media_serve(request, path, document_root=None, show_indexes=False):
+    """
+    Раздача MEDIA без файлов книг, оставшихся в MEDIA_ROOT до переноса
+    в BOOK_FILES_ROOT. Путь нормализуется до проверки так же,
+    как в serve, поэтому /books/../books_file/... и /./books_file/...
+    тоже не отдаются. Без document_root раздается текущий MEDIA_ROOT.
+    """
+    name = posixpath.normpath(path).lstrip('/')
+    if name.split('/', 1)[0] == BOOK_FILES_DIRECTORY:
+        raise Http404
+    return serve(request, path, document_root or settings.MEDIA_ROOT,
+                 show_indexes)
+
+
+def parse_range(header, size):
+    """
+    Диапазон из заголовка Range: (начало, длина).
+    None - заголовка нет или несколько диапазонов (отдается весь файл),
+    False - диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        return (size - length, length) if length else False
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        return False
+    return first, last - first + 1
+
+
+def accelerated_response(field_file, filename):
+    """Ответ без тела: файл отдает nginx или Apache по заголовку"""
+    response = HttpResponse()
+    if DOWNLOAD_ACCEL == 'nginx':
+        response['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + field_file.name
+    else:
+        response['X-Sendfile'] = field_file.path
+    # Тип файла определит веб-сервер
+    del response['Content-Type']
+    response['Content-Disposition'] = content_disposition_header(
+        True, filename
+    )
+    return response
+
+
+def file_response(request, field_file, filename):
+    """
+    Отдача файла после проверки прав.
+    При DOWNLOAD_ACCEL файл отдает веб-сервер, иначе FileResponse
+    с поддержкой Range и If-Range для докачки.
+    """
+    if DOWNLOAD_ACCEL:
+        return accelerated_response(field_file, filename)
+    file = open(field_file.path, 'rb')
+    stat = os.fstat(file.fileno())
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = http_date(stat.st_mtime)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and if_range in (None, etag,
+                                                   last_modified):
+        byte_range = parse_range(request.headers['Range'], stat.st_size)
+    if byte_range is False:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if byte_range:
+        start, length = byte_range
+        response = FileResponse(
+            FileRange(file, start, length), status=206,
+            as_attachment=True, filename=filename
+        )
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{stat.st_size}'
+        )
+        response['Content-Length'] = length
+    else:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+
+
+class ZipBuffer:
+    """
+    Файл, в который zipfile пишет архив.
+    Позиции (seek) нет, поэтому zipfile пишет размеры и CRC после
+    данных каждого файла, а записанное сразу забирается для отправки.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_stream(files, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    ZIP архив кусками по мере чтения файлов.
+    files - пары (путь к файлу, имя в архиве). В памяти одновременно
+    не больше одного куска файла и его сжатой версии.
+    """
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for path, name in files:
+            if not os.path.exists(path):
+                logger.warning('Файл %s не найден', path)
+                continue
+            info = zipfile.ZipInfo.from_file(path, name)
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if path.lower().endswith(ZIP_STORED_EXTENSIONS)
+                else zipfile.ZIP_DEFLATED
+            )
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    if buffer.chunks:
+                        yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def library_files(book_files):
+    """
+    Пути файлов книг и имена в архиве: папка на книгу,
+    формат в расширении (Книга/Книга.pdf, Книга/Книга.ios.epub).
+    Книги с одинаковым названием получают id в имени папки.
+    """
+    folders = {}
+    for book_file in book_files:
+        book = book_file.book
+        name = re.sub(r'[\\/]', '_', book.name)
+        if book.id not in folders:
+            folders[book.id] = (
+                f'{name} ({book.id})' if name in folders.values() else name
+            )
+        yield (book_file.file.path,
+               f'{folders[book.id]}/{name}.{book_file.name.lower()}')
@@ -0,0 +1,133 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Job, Order
+from bookstore.settings import (DOMEN, EMAIL_HOST_USER, JOBS_LOCK_TIMEOUT,
+                                JOBS_MAX_ATTEMPTS, JOBS_RETRY_DELAY)
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def job(name):
+    """Регистрация обработчика задачи под именем name"""
+    def decorator(func):
+        HANDLERS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, key, repeat=False, **payload):
+    """
+    Постановка задачи в очередь.
+    key - ключ идемпотентности: задача с тем же ключом ставится один раз,
+    поэтому повторный запрос оплаты не отправит второе письмо.
+    repeat - завершенная или отложенная задача с тем же ключом ставится
+    на выполнение сейчас с новым счетчиком попыток (повторные проверки).
+    Если вызвана внутри транзакции, задача видна воркеру после коммита.
+    """
+    try:
+        with transaction.atomic():
+            job, created = Job.objects.get_or_create(
+                key=key, defaults={'name': name, 'payload': payload}
+            )
+    except IntegrityError:
+        job, created = Job.objects.get(key=key), False
+    if repeat and not created:
+        Job.objects.filter(
+            id=job.id, status__in=('pending', 'done', 'failed')
+        ).update(status='pending', run_after=timezone.now(), attempts=0,
+                 last_error='')
+    return job
+
+
+def _claim(job_id):
+    """
+    Захват задачи одним UPDATE: если задачу уже взял другой воркер,
+    строка не обновится.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=JOBS_LOCK_TIMEOUT)
+    return Job.objects.filter(
+        Q(status='pending') | Q(status='running', locked_at__lt=stale),
+        id=job_id,
+    ).update(status='running', locked_at=now, attempts=F('attempts') + 1)
+
+
+def _ready_ids(limit):
+    now = timezone.now()
+    stale = now - timedelta(seconds=JOBS_LOCK_TIMEOUT)
+    return list(Job.objects.filter(
+        Q(status='pending', run_after__lte=now)
+        | Q(status='running', locked_at__lt=stale)
+    ).order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+
+
+def run_job(job):
+    """
+    Выполнение захваченной задачи.
+    При ошибке задача откладывается на JOBS_RETRY_DELAY * 2^(попытка-1)
+    секунд, после JOBS_MAX_ATTEMPTS попыток помечается как failed.
+    """
+    try:
+        HANDLERS[job.name](**job.payload)
+    except Exception:
+        logger.exception('Задача %s (%s) не выполнена', job.name, job.key)
+        job.last_error = traceback.format_exc()
+        job.locked_at = None
+        if job.attempts >= JOBS_MAX_ATTEMPTS:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.run_after = timezone.now() + timedelta(
+                seconds=JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        job.save(update_fields=[
+            'status', 'run_after', 'locked_at', 'last_error'
+        ])
+        return False
+    job.status = 'done'
+    job.locked_at = None
+    job.save(update_fields=['status', 'locked_at'])
+    return True
+
+
+def run_pending(limit=50):
+    """Выполнение готовых задач. Возвращает (выполнено, с ошибкой)"""
+    done = failed = 0
+    for job_id in _ready_ids(limit):
+        if not _claim(job_id):
+            continue
+        if run_job(Job.objects.get(id=job_id)):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+@job('order_mail')
+def order_mail(order_id):
+    """Письмо со ссылками на файлы купленных книг"""
+    order = Order.objects.select_related('user').get(id=order_id)
+    html_message = (f'Вы успешно оплатили заказ на '
+                    f'<a href="{DOMEN}">сайте</a>!<br>'
+                    'Нажмите на формат для скачивания книги:<br><br>')
+    for book in order.book.prefetch_related('files'):
+        html_message += f'{book.name}:<br>'
+        for file in book.files.all():
+            url = reverse('users:get_book', args=[book.id, file.name])
+            html_message += (f'&emsp;<a href="{DOMEN}{url}">'
+                             f'{file.name}</a><br>')
+    send_mail(subject=f'Заказ #{order.user.id}-{order.id} оплачен',
+              message=None,
+              from_email=EMAIL_HOST_USER,
+              recipient_list=[order.user.email],
+              html_message=html_message)
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from importlib import import_module
+from statistics import quantiles
+
+from django.conf import settings
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY)
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from books.benchmark import fill_books
+from books.models import Book, Genre
+from users.models import CustomUser
+
+PREFIX = 'bench-ajax-'
+SERVERS = {
+    'uvicorn': [sys.executable, '-m', 'uvicorn', 'bookstore.asgi:application',
+                '--port', '{port}', '--log-level', 'warning'],
+    'runserver': [sys.executable, 'manage.py', 'runserver', '--noreload',
+                  '127.0.0.1:{port}'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('Сервер не запустился')
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('Сервер не открыл порт')
+
+
+def login_session(user):
+    """Сессия авторизованного пользователя без запроса к login"""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+async def request(reader, writer, raw):
+    """Запрос по keep-alive соединению, ответ читается по Content-Length"""
+    writer.write(raw)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port, raws, count, timings, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for index in range(count):
+            start = time.perf_counter()
+            status = await request(reader, writer, raws[index % len(raws)])
+            timings.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port, raws, concurrency, requests):
+    timings, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, raws, requests // concurrency, timings, errors)
+        for _ in range(concurrency)
+    ))
+    return time.perf_counter() - start, timings, errors
+
+
+class Command(BaseCommand):
+    help = ('Нагрузка на AJAX-запросы страниц (избранное, корзина, иконка '
+            'корзины): запросов в секунду и p99 под uvicorn или runserver')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=SERVERS, default='uvicorn')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def scenarios(self, session_key, books):
+        token = secrets.token_hex(16)
+        headers = (f'Host: 127.0.0.1\r\nCookie: '
+                   f'{settings.SESSION_COOKIE_NAME}={session_key}; '
+                   f'{settings.CSRF_COOKIE_NAME}={token}\r\n'
+                   f'X-CSRFToken: {token}\r\n')
+
+        def post(url, data):
+            return (f'POST {url} HTTP/1.1\r\n{headers}'
+                    'Content-Type: application/x-www-form-urlencoded\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n{data}').encode()
+
+        return {
+            'take_cart_img': [
+                f'GET {reverse("users:take_cart_img")} HTTP/1.1\r\n'
+                f'{headers}\r\n'.encode()
+            ],
+            'change_favorite': [
+                post(reverse('books:change_favorite'), f'book={book.id}')
+                for book in books
+            ],
+            'change_cart': [
+                post(reverse('books:change_cart'), f'book={book.id}')
+                for book in books
+            ],
+        }
+
+    def handle(self, *args, **options):
+        """
+        Данные создаются в БД и удаляются после замера, сервер
+        запускается отдельным процессом с текущими настройками.
+        Для сравнения sync и async view команда запускается на версиях
+        кода до и после перевода view.
+        """
+        genre_ids = fill_books(20, genres=3)
+        books = list(Book.objects.filter(genre__in=genre_ids).distinct())
+        user = CustomUser.objects.create(
+            username=PREFIX, email=f'{PREFIX}@example.com'
+        )
+        port = free_port()
+        command = [part.format(port=port)
+                   for part in SERVERS[options['server']]]
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=os.environ.copy(),
+            stdout=subprocess.DEVNULL
+        )
+        try:
+            wait_port(port, server)
+            scenarios = self.scenarios(login_session(user), books)
+            for name, raws in scenarios.items():
+                asyncio.run(load(port, raws, options['concurrency'], 100))
+                elapsed, timings, errors = asyncio.run(load(
+                    port, raws, options['concurrency'], options['requests']
+                ))
+                percentiles = quantiles(timings, n=100, method='inclusive')
+                self.stdout.write(
+                    f'{name:<16} {len(timings) / elapsed:8.0f} запр/с  '
+                    f'p50={percentiles[49]:7.2f}ms '
+                    f'p99={percentiles[98]:7.2f}ms'
+                    + (f'  ошибок {len(errors)}: {set(errors)}'
+                       if errors else '')
+                )
+        finally:
+            server.terminate()
+            server.wait()
+            CustomUser.objects.filter(id=user.id).delete()
+            Book.objects.filter(id__in=[book.id for book in books]).delete()
+            Genre.objects.filter(id__in=genre_ids).delete()
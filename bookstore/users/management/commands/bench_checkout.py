@@ -0,0 +1,100 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from books.benchmark import fill_books
+from books.models import Book, Genre
+from users.models import CustomUser, Job, Order
+from users.payments import settle_order
+
+PREFIX = 'bench-checkout-'
+
+
+class Command(BaseCommand):
+    help = ('Проверка одновременной оплаты заказов с общими книгами: '
+            'счетчики buying, библиотеки и корзины после settle_order')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50)
+        parser.add_argument('--books', type=int, default=5)
+        parser.add_argument('--workers', type=int, default=16)
+
+    def settle(self, started, order_id):
+        try:
+            started.wait()
+            return settle_order(order_id, f'{PREFIX}{order_id}')
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        """
+        Каждый заказ оплачивается дважды одновременно (уведомление
+        и сверка), закрыться должен ровно один раз.
+        Данные создаются в БД и удаляются после проверки, поэтому
+        одновременность настоящая только на PostgreSQL, SQLite выполнит
+        транзакции по очереди.
+        """
+        genre_ids = fill_books(options['books'], genres=3)
+        books = list(Book.objects.filter(genre__in=genre_ids).distinct())
+        users, orders = [], []
+        try:
+            buying = {book.id: book.buying for book in books}
+            for index in range(options['orders']):
+                user = CustomUser.objects.create(
+                    username=f'{PREFIX}{index}',
+                    email=f'{PREFIX}{index}@example.com'
+                )
+                users.append(user)
+                order = user.order.get()
+                order.book.add(*books)
+                order.fill_lines()
+                order.payment = f'{PREFIX}{order.id}'
+                order.save()
+                orders.append(order.id)
+
+            calls = orders * 2
+            started = Event()
+            with ThreadPoolExecutor(options['workers']) as executor:
+                results = executor.map(
+                    lambda order_id: self.settle(started, order_id), calls
+                )
+                start = time.perf_counter()
+                started.set()
+                settled = sum(results)
+            elapsed = time.perf_counter() - start
+
+            errors = []
+            if settled != len(orders):
+                errors.append(f'закрыто {settled} раз вместо {len(orders)}')
+            for book in Book.objects.filter(id__in=buying):
+                if book.buying - buying[book.id] != len(orders):
+                    errors.append(
+                        f'книга {book.id}: buying +'
+                        f'{book.buying - buying[book.id]}'
+                    )
+            owned = CustomUser.buyed_books.through.objects.filter(
+                customuser__in=users
+            ).count()
+            if owned != len(orders) * len(books):
+                errors.append(f'в библиотеках {owned} книг')
+            carts = Order.objects.filter(user__in=users, close=False).count()
+            if carts != len(users):
+                errors.append(f'открытых корзин {carts}')
+            self.stdout.write(
+                f'{connection.vendor}: {len(calls)} оплат '
+                f'{len(orders)} заказов за {elapsed:.2f}с '
+                f'({len(calls) / elapsed:.0f} в секунду)'
+            )
+        finally:
+            Job.objects.filter(
+                key__in=[f'order-mail-{order_id}' for order_id in orders]
+            ).delete()
+            CustomUser.objects.filter(username__startswith=PREFIX).delete()
+            Book.objects.filter(id__in=[book.id for book in books]).delete()
+            Genre.objects.filter(id__in=genre_ids).delete()
+        if errors:
+            raise CommandError('; '.join(errors))
+        self.stdout.write('Счетчики и библиотеки сходятся')
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from books.benchmark import fill_books, max_rss
+from books.models import Book, BookFiles, Genre
+from books.storage import book_files_storage
+from books.validator import BOOK_FILES_DIRECTORY
+from users.models import CustomUser
+from users.views import library_zip
+
+PREFIX = 'bench-zip-'
+FORMATS = ('PDF', 'FB2')
+MB = 1024 * 1024
+
+
+def write_file(path, size, text):
+    """Файл книги: случайные байты (PDF) или повторяющийся текст (FB2)"""
+    line = 'Глава. Текст книги для замера архива.\n'.encode()
+    with open(path, 'wb') as file:
+        for start in range(0, size, MB):
+            length = min(MB, size - start)
+            file.write(
+                (line * (length // len(line) + 1))[:length]
+                if text else os.urandom(length)
+            )
+
+
+class Command(BaseCommand):
+    help = ('Проверка памяти при скачивании библиотеки ZIP архивом: '
+            'пик не должен расти вместе с размером архива')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20)
+        parser.add_argument('--size', type=int, default=20,
+                            help='Размер файла книги в МБ')
+        parser.add_argument('--max-memory', type=int, default=32,
+                            help='Допустимый прирост памяти в МБ')
+
+    def handle(self, *args, **options):
+        genre_ids = fill_books(options['books'], genres=3)
+        books = list(Book.objects.filter(genre__in=genre_ids).distinct())
+        user = CustomUser.objects.create(
+            username=PREFIX, email=f'{PREFIX}@example.com'
+        )
+        directory = os.path.join(
+            BOOK_FILES_DIRECTORY, f'{PREFIX}{user.id}'
+        )
+        root = book_files_storage.path(directory)
+        os.makedirs(root, exist_ok=True)
+        try:
+            for book in books:
+                for name in FORMATS:
+                    path = f'{directory}/{book.id}.{name.lower()}'
+                    write_file(book_files_storage.path(path),
+                               options['size'] * MB, name == 'FB2')
+                    BookFiles.objects.create(book=book, name=name, file=path)
+            user.buyed_books.add(*books)
+            request = RequestFactory().get('/my/library/zip')
+            request.user = user
+
+            rss = max_rss()
+            tracemalloc.start()
+            start = time.perf_counter()
+            with tempfile.TemporaryFile() as archive:
+                for chunk in library_zip(request).streaming_content:
+                    archive.write(chunk)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                growth = max_rss() - rss if rss is not None else 0
+                size = archive.tell()
+                archive.seek(0)
+                with zipfile.ZipFile(archive) as check:
+                    broken = check.testzip()
+                    count = len(check.infolist())
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            CustomUser.objects.filter(id=user.id).delete()
+            Book.objects.filter(id__in=[book.id for book in books]).delete()
+            Genre.objects.filter(id__in=genre_ids).delete()
+
+        total = len(books) * len(FORMATS) * options['size'] * MB
+        self.stdout.write(
+            f'{count} файлов, {total / MB:.0f} МБ -> архив {size / MB:.0f} '
+            f'МБ за {elapsed:.2f}с ({total / MB / elapsed:.0f} МБ/с)\n'
+            f'Пик Python (tracemalloc): {peak / MB:.1f} МБ'
+            + (f', прирост RSS: {growth / MB:.1f} МБ' if rss is not None
+               else '')
+        )
+        if broken:
+            raise CommandError(f'Поврежден файл архива {broken}')
+        if count != len(books) * len(FORMATS):
+            raise CommandError(f'В архиве {count} файлов')
+        if max(peak, growth) > options['max_memory'] * MB:
+            raise CommandError(
+                f'Память выросла больше {options["max_memory"]} МБ'
+            )
+        self.stdout.write('Архив собирается без роста памяти')
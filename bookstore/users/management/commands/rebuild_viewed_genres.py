@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from bookstore.settings import MAX_VIEWED_GENRES
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполнение буфера просмотренных жанров пользователей '
+        'по сохраненным ViewedGenres'
+    )
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.filter(viewed__isnull=False).distinct()
+        for user in users.iterator():
+            genre_ids = list(user.viewed.order_by('-id').values_list(
+                'genre_id', flat=True)[:MAX_VIEWED_GENRES])
+            user.viewed_genres_history = []
+            user.viewed_genres_counts = {}
+            user.add_viewed_genres(reversed(genre_ids))
+        self.stdout.write(f'Обновлено пользователей: {users.count()}')
@@ -0,0 +1,88 @@
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from users.models import Order
+from users.payments import PaymentMismatch, apply_status, get_gateway
+from bookstore.settings import (PAYMENT_RECONCILE_BATCH,
+                                PAYMENT_RECONCILE_WORKERS, PAYMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Сверка неоплаченных заказов с платежным шлюзом '
+            '(на случай потерянных уведомлений)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int,
+                            default=PAYMENT_RECONCILE_BATCH)
+        parser.add_argument('--workers', type=int,
+                            default=PAYMENT_RECONCILE_WORKERS)
+        parser.add_argument('--timeout', type=float, default=PAYMENT_TIMEOUT,
+                            help='Секунд на ответы шлюза по одной пачке')
+
+    def handle(self, *args, **options):
+        """
+        Статусы запрашиваются пачками в пуле потоков, запись в БД идет
+        в основном потоке. Платежи без ответа за timeout пропускаются
+        до следующего запуска, их потоки завершаются по таймауту
+        HTTP запроса к шлюзу (PAYMENT_TIMEOUT).
+        """
+        gateway = get_gateway()
+        orders = Order.objects.filter(
+            Q(payment__gt='') | ~Q(superseded_payments={}), close=False
+        )
+        stats = Counter()
+        start = time.perf_counter()
+        last_id = 0
+        executor = ThreadPoolExecutor(options['workers'])
+        try:
+            while True:
+                batch = list(orders.filter(id__gt=last_id).order_by(
+                    'id'
+                ).values_list(
+                    'id', 'payment', 'superseded_payments'
+                )[:options['batch']])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                futures = {
+                    executor.submit(gateway.find, payment_id): payment_id
+                    for _, payment, superseded in batch
+                    for payment_id in [payment, *superseded] if payment_id
+                }
+                done, not_done = wait(futures, timeout=options['timeout'])
+                for future in not_done:
+                    future.cancel()
+                stats['timeout'] += len(not_done)
+                for future in done:
+                    payment_id = futures[future]
+                    try:
+                        payment = future.result()
+                    except Exception:
+                        logger.exception('Платеж %s не проверен', payment_id)
+                        stats['error'] += 1
+                        continue
+                    try:
+                        final = apply_status(
+                            payment_id, payment['status'], payment['amount']
+                        )
+                    except PaymentMismatch:
+                        logger.exception('Платеж %s не применен', payment_id)
+                        stats['mismatch'] += 1
+                        continue
+                    if final:
+                        stats[payment['status']] += 1
+                    else:
+                        stats['pending'] += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.stdout.write(
+            f'Проверено за {time.perf_counter() - start:.2f}с: '
+            + ', '.join(f'{key}={value}' for key, value in stats.items())
+        )
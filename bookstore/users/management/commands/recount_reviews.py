@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.models import Book
+from users.models import recount_reviews
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков и оценок книг по отзывам'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        updated = recount_reviews(Book.objects.all())
+        self.stdout.write(f'Пересчитано книг: {updated}')
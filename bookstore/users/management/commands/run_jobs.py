@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.jobs import run_pending
+from bookstore.settings import JOBS_POLL_INTERVAL
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач (письма и выдача книг после оплаты)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и завершиться'
+        )
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument(
+            '--interval', type=float, default=JOBS_POLL_INTERVAL
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            done, failed = run_pending(options['limit'])
+            if done or failed:
+                self.stdout.write(
+                    f'Выполнено: {done}, с ошибкой: {failed}'
+                )
+            if options['once']:
+                return
+            if not (done or failed):
+                time.sleep(options['interval'])
@@ -1,11 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models import (Case, Count, F, OuterRef, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce, Now
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 from books.models import Book, Genre
+from bookstore.settings import MAX_VIEWED_GENRES
 
 
 class ViewedGenres(models.Model):
@@ -65,6 +70,16 @@ class CustomUser(AbstractUser):
         'Количество просмотренных жанров',
         default=0,
     )
+    viewed_genres_history = models.JSONField(
+        'Последние просмотренные жанры',
+        default=list,
+        blank=True,
+    )
+    viewed_genres_counts = models.JSONField(
+        'Просмотры жанров среди последних',
+        default=dict,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -74,29 +89,47 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+    def add_viewed_genres(self, genre_ids):
+        """
+        Добавление просмотренных жанров в кольцевой буфер
+        последних MAX_VIEWED_GENRES жанров со счетчиками по жанрам.
+        Наиболее просматриваемый жанр выбирается из счетчиков буфера,
+        без агрегации по таблице ViewedGenres.
+        """
+        history = self.viewed_genres_history
+        counts = self.viewed_genres_counts
+        for genre_id in genre_ids:
+            history.append(genre_id)
+            counts[str(genre_id)] = counts.get(str(genre_id), 0) + 1
+            if len(history) > MAX_VIEWED_GENRES:
+                early_genre = str(history.pop(0))
+                counts[early_genre] -= 1
+                if not counts[early_genre]:
+                    del counts[early_genre]
+        self.most_viewed_genres_id = (
+            int(max(counts, key=counts.get)) if counts else None
+        )
+        self.viewed_genres = len(history)
+        self.save(update_fields=[
+            'viewed_genres_history',
+            'viewed_genres_counts',
+            'most_viewed_genres',
+            'viewed_genres',
+        ])
+        if self.viewed_genres == MAX_VIEWED_GENRES:
+            self.viewed.exclude(id__in=self.viewed.order_by('-id').values(
+                'id')[:MAX_VIEWED_GENRES]).delete()
+
     @receiver(post_save, sender=ViewedGenres)
     def user_view_book_page(sender, instance, created, **kwargs):
         """
         После посещения пользователем страницы книги,
         его список жанров изменяется.
-        Список ограничивается 20 жанрами и при переполнении
+        Список ограничивается MAX_VIEWED_GENRES жанрами и при переполнении
         удаляет старые просмотренные жанры.
         """
         if created:
-            user = instance.user
-            user.most_viewed_genres = Genre.objects.get(
-                id=ViewedGenres.objects.values('genre')
-                .annotate(viewed=models.Count('genre'))
-                .order_by('-viewed')[0]['genre']
-            )
-            user.viewed_genres += 1
-            if user.viewed_genres >= 20:
-                while user.viewed_genres != 20:
-                    user.viewed_genres -= 1
-                    early_genre = ViewedGenres.objects.filter(
-                        user=user).order_by('id')[0]
-                    early_genre.delete()
-            user.save()
+            instance.user.add_viewed_genres([instance.genre_id])
 
 
 class Review(models.Model):
@@ -132,6 +165,82 @@ class Review(models.Model):
     def __str__(self):
         return f'{self.user} оставил отзыв к {self.book}'
 
+    @receiver(pre_save, sender='users.Review')
+    def remember_review_score(sender, instance, **kwargs):
+        """Перед изменением отзыва запоминаем прежнюю оценку"""
+        instance.old_score = Review.objects.filter(
+            id=instance.id
+        ).values_list('score', flat=True).first() if instance.id else None
+
+    @receiver(post_save, sender='users.Review')
+    def review_saved(sender, instance, created, **kwargs):
+        if created:
+            update_book_score(instance.book_id, 1, instance.score)
+        elif instance.old_score is not None:
+            update_book_score(
+                instance.book_id, 0, instance.score - instance.old_score
+            )
+
+    @receiver(post_delete, sender='users.Review')
+    def review_deleted(sender, instance, **kwargs):
+        update_book_score(instance.book_id, -1, -instance.score)
+
+
+def update_book_score(book_id, count_delta, score_delta):
+    """
+    Изменение счетчиков отзывов книги одним UPDATE с F-выражениями,
+    без загрузки всех отзывов. Оценка книги - целая часть среднего.
+    Если счетчики ушли бы ниже нуля (разошлись с отзывами, например
+    в базе до recount_reviews), счетчики книги пересчитываются.
+    """
+    review_count = F('review_count') + count_delta
+    review_sum = F('review_sum') + score_delta
+    updated = Book.objects.filter(
+        id=book_id,
+        review_count__gte=-count_delta,
+        review_sum__gte=-score_delta,
+    ).update(
+        review_count=review_count,
+        review_sum=review_sum,
+        score=Case(
+            When(review_count__lte=-count_delta, then=Value(0)),
+            default=review_sum / review_count,
+            output_field=models.PositiveIntegerField()
+        ),
+        updated_at=Now()
+    )
+    if not updated:
+        recount_reviews(Book.objects.filter(id=book_id))
+
+
+def recount_reviews(books):
+    """
+    Пересчет счетчиков и оценок книг books по таблице отзывов
+    подзапросами, без загрузки отзывов. Возвращает число книг.
+    updated_at обновляется, чтобы исправленные оценки не остались
+    в кеше карточек и ETag страниц.
+    """
+    reviews = Review.objects.filter(
+        book=OuterRef('pk')
+    ).order_by().values('book')
+    updated = books.update(
+        review_count=Coalesce(Subquery(
+            reviews.annotate(count=Count('id')).values('count')
+        ), Value(0)),
+        review_sum=Coalesce(Subquery(
+            reviews.annotate(total=Sum('score')).values('total')
+        ), Value(0)),
+    )
+    books.update(
+        score=Case(
+            When(review_count=0, then=Value(0)),
+            default=F('review_sum') / F('review_count'),
+            output_field=models.PositiveIntegerField()
+        ),
+        updated_at=Now()
+    )
+    return updated
+
 
 class Order(models.Model):
     user = models.ForeignKey(
@@ -167,6 +276,13 @@ class Order(models.Model):
         null=True,
         blank=True
     )
+    superseded_payments = models.JSONField(
+        'Замененные платежи',
+        help_text='id платежа -> сумма и строки заказа на момент '
+                  'его создания, оплата такого платежа тоже закрывает заказ',
+        default=dict,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = 'Заказ'
@@ -175,8 +291,139 @@ class Order(models.Model):
     def __str__(self):
         return f'Заказ {self.user}, {"Закрыт" if self.close else "Не закрыт"}'
 
+    def fill_lines(self):
+        """
+        Фиксация книг корзины и их цен на момент создания платежа
+        в строках заказа (прежние строки заменяются) и сумма заказа
+        по ним. Возвращает созданные строки.
+        """
+        lines = [
+            OrderLine(order=self, book_id=book_id, name=name, price=price)
+            for book_id, name, price in self.book.values_list(
+                'id', 'name', 'final_price')
+        ]
+        self.lines.all().delete()
+        OrderLine.objects.bulk_create(lines)
+        self.amount = sum(line.price for line in lines)
+        return lines
+
+    def lines_snapshot(self):
+        """Сумма и строки заказа для замененного платежа"""
+        return {
+            'amount': self.amount,
+            'lines': list(self.lines.values_list('book_id', 'name', 'price')),
+        }
+
+    def restore_lines(self, snapshot):
+        """Строки и сумма заказа из lines_snapshot()"""
+        self.lines.all().delete()
+        OrderLine.objects.bulk_create(
+            OrderLine(order=self, book_id=book_id, name=name, price=price)
+            for book_id, name, price in snapshot['lines']
+        )
+        self.amount = snapshot['amount']
+
+    def lines_match_cart(self):
+        """Корзина и цены книг не менялись с фиксации строк заказа"""
+        return set(self.book.values_list('id', 'final_price')) == set(
+            self.lines.values_list('book_id', 'price')
+        )
+
     @receiver(post_save, sender=CustomUser)
     def create_first_user_order(sender, instance, created, **kwargs):
         """После регистрации создается первый незакрытый заказ - его корзина"""
         if created:
             Order.objects.create(user=instance)
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='lines',
+        verbose_name='Заказ',
+    )
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.SET_NULL,
+        related_name='order_lines',
+        verbose_name='Книга',
+        null=True,
+    )
+    name = models.CharField(
+        'Название книги на момент покупки',
+        max_length=200,
+    )
+    price = models.PositiveIntegerField(
+        'Цена книги на момент покупки',
+    )
+
+    class Meta:
+        verbose_name = 'Строка заказа'
+        verbose_name_plural = 'Строки заказов'
+        unique_together = [['order', 'book']]
+
+    def __str__(self):
+        return f'{self.name} - {self.price} ₽'
+
+
+class Job(models.Model):
+    """Фоновая задача, выполняется командой run_jobs"""
+    name = models.CharField(
+        'Задача',
+        max_length=100,
+    )
+    key = models.CharField(
+        'Ключ идемпотентности',
+        max_length=200,
+        unique=True,
+    )
+    payload = models.JSONField(
+        'Параметры',
+        default=dict,
+        blank=True,
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=10,
+        choices=[
+            ('pending', 'Ожидает'),
+            ('running', 'Выполняется'),
+            ('done', 'Выполнена'),
+            ('failed', 'Ошибка'),
+        ],
+        default='pending',
+    )
+    attempts = models.PositiveIntegerField(
+        'Попыток',
+        default=0,
+    )
+    run_after = models.DateTimeField(
+        'Выполнить после',
+        default=timezone.now,
+    )
+    locked_at = models.DateTimeField(
+        'Взята в работу',
+        null=True,
+        blank=True,
+    )
+    last_error = models.TextField(
+        'Последняя ошибка',
+        blank=True,
+    )
+    created = models.DateTimeField(
+        'Создана',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'], name='job_status_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
@@ -0,0 +1,279 @@
+import logging
+import time
+import uuid
+from datetime import date
+from decimal import Decimal
+from functools import partial
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Now
+from django.urls import reverse
+from yookassa import Payment
+from yookassa.client import ApiClient
+from yookassa.domain.common import SecurityHelper
+from yookassa.domain.exceptions import NotFoundError
+
+from .cart import reset_cart_count
+from .jobs import enqueue, job
+from .models import CustomUser, Order
+from books.cache import clear_sliders
+from books.models import Book
+from bookstore.settings import (DOMEN, PAYMENT_GATEWAY, PAYMENT_IP_HEADER,
+                                PAYMENT_STUB_DELAY, PAYMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+STUB_CACHE_KEY = 'users:payment_stub:{}'
+
+
+class PaymentPending(Exception):
+    """Платеж еще не завершен, задача проверки будет повторена"""
+
+
+class PaymentMismatch(Exception):
+    """Сумма платежа в шлюзе не совпадает с зафиксированной суммой заказа"""
+
+
+class TimeoutApiClient(ApiClient):
+    """
+    Клиент SDK Юкассы с таймаутом HTTP запроса PAYMENT_TIMEOUT.
+    SDK не передает таймаут в requests (Configuration.timeout задает
+    только паузу между повторами), без него зависший ответ шлюза
+    держит воркер и потоки сверки.
+    """
+
+    def get_session(self):
+        session = super().get_session()
+        session.request = partial(session.request, timeout=PAYMENT_TIMEOUT)
+        return session
+
+
+class TimeoutPayment(Payment):
+    def __init__(self):
+        self.client = TimeoutApiClient()
+
+
+class YooKassaGateway:
+    """Платежи через API Юкассы"""
+    name = 'yookassa'
+
+    def create(self, amount, return_url):
+        payment = TimeoutPayment.create({
+            "amount": {
+                "value": f"{float(amount)}",
+                "currency": "RUB"
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": return_url
+            },
+            "capture": True
+        }, uuid.uuid4())
+        return payment.id, payment.confirmation.confirmation_url
+
+    def find(self, payment_id):
+        """
+        Статус, сумма и страница оплаты платежа.
+        Неизвестный шлюзу платеж - LookupError, как у заглушки.
+        """
+        try:
+            payment = TimeoutPayment.find_one(payment_id)
+        except NotFoundError as error:
+            raise LookupError(f'Платеж {payment_id} не найден') from error
+        return {
+            'status': payment.status,
+            'amount': Decimal(payment.amount.value),
+            'confirmation_url': getattr(
+                payment.confirmation, 'confirmation_url', None
+            ),
+        }
+
+    def status(self, payment_id):
+        return self.find(payment_id)['status']
+
+    def is_trusted(self, request):
+        """Уведомления Юкассы приходят только с ее адресов"""
+        return SecurityHelper().is_ip_trusted(
+            request.META.get(PAYMENT_IP_HEADER, '')
+        )
+
+
+class StubGateway:
+    """
+    Локальная заглушка платежного шлюза для разработки и замеров.
+    Статусы платежей хранятся в файловом кеше payments, поэтому видны
+    и сайту, и воркеру, и не вытесняются другими записями.
+    Страница оплаты (users:payment_stub) сразу завершает платеж.
+    delay - искусственная задержка ответа шлюза в секундах.
+    """
+    name = 'stub'
+
+    def __init__(self, delay=0):
+        self.delay = delay
+
+    def create(self, amount, return_url):
+        payment_id = f'stub-{uuid.uuid4()}'
+        caches['payments'].set(STUB_CACHE_KEY.format(payment_id), {
+            'status': 'pending', 'amount': amount, 'return_url': return_url
+        }, None)
+        return payment_id, DOMEN + reverse(
+            'users:payment_stub', args=[payment_id]
+        )
+
+    def get(self, payment_id):
+        return caches['payments'].get(STUB_CACHE_KEY.format(payment_id))
+
+    def set_status(self, payment_id, status):
+        payment = self.get(payment_id)
+        payment['status'] = status
+        caches['payments'].set(
+            STUB_CACHE_KEY.format(payment_id), payment, None
+        )
+        return payment
+
+    def find(self, payment_id):
+        if self.delay:
+            time.sleep(self.delay)
+        payment = self.get(payment_id)
+        if payment is None:
+            raise LookupError(f'Платеж {payment_id} не найден')
+        return {
+            'status': payment['status'],
+            'amount': Decimal(payment['amount']),
+            'confirmation_url': DOMEN + reverse(
+                'users:payment_stub', args=[payment_id]
+            ),
+        }
+
+    def status(self, payment_id):
+        return self.find(payment_id)['status']
+
+    def is_trusted(self, request):
+        return True
+
+
+def get_gateway():
+    if PAYMENT_GATEWAY == 'stub':
+        return StubGateway(PAYMENT_STUB_DELAY)
+    return YooKassaGateway()
+
+
+def payment_orders(payment_id):
+    """Заказы с платежом: текущим или замененным новым платежом"""
+    return Order.objects.filter(
+        Q(payment=payment_id) | Q(superseded_payments__has_key=payment_id)
+    )
+
+
+def settle_order(order_id, payment_id, amount=None):
+    """
+    Закрытие оплаченного заказа одной транзакцией: книги строк заказа,
+    зафиксированных при создании платежа, в библиотеку одним INSERT,
+    buying + 1 одним UPDATE, новая корзина и письмо в очередь.
+    Книги, удаленные из корзины после создания платежа, не учитываются,
+    добавленные после него переходят в новую корзину. Если оплачен
+    замененный платеж, заказ закрывается по его строкам и сумме.
+    amount - сумма платежа в шлюзе, при расхождении с суммой заказа
+    заказ не закрывается (PaymentMismatch).
+    Заказ закрывается условным UPDATE, поэтому при одновременных
+    уведомлении, возврате пользователя и сверке он оплачивается один раз.
+    Строки книг блокируются по порядку id, чтобы одновременные заказы
+    с общими книгами не взаимоблокировались.
+    """
+    with transaction.atomic():
+        closed = payment_orders(payment_id).filter(
+            id=order_id, close=False
+        ).update(close=True, close_data=date.today())
+        if not closed:
+            return False
+        order = Order.objects.select_related('user').get(id=order_id)
+        snapshot = order.superseded_payments.pop(payment_id, None)
+        if snapshot is not None:
+            order.restore_lines(snapshot)
+            order.payment = payment_id
+            order.save(update_fields=[
+                'payment', 'amount', 'superseded_payments'
+            ])
+        if amount is not None and Decimal(amount) != order.amount:
+            raise PaymentMismatch(
+                f'Платеж {payment_id}: {amount} вместо {order.amount}'
+            )
+        if not order.lines.exists():
+            # Платеж создан до фиксации строк заказа при оплате
+            order.fill_lines()
+        book_ids = list(order.lines.exclude(book=None).values_list(
+            'book_id', flat=True
+        ))
+        extra_ids = list(order.book.exclude(id__in=book_ids).values_list(
+            'id', flat=True
+        ))
+        order.book.set(book_ids)
+        through = CustomUser.buyed_books.through
+        through.objects.bulk_create(
+            [through(customuser_id=order.user_id, book_id=book_id)
+             for book_id in book_ids],
+            ignore_conflicts=True
+        )
+        books = Book.objects.filter(id__in=book_ids)
+        list(books.order_by('id').select_for_update().values_list('id'))
+        books.update(buying=F('buying') + 1, updated_at=Now())
+        Order.objects.create(user=order.user).book.add(*extra_ids)
+        enqueue('order_mail', f'order-mail-{order.id}', order_id=order.id)
+    clear_sliders()
+    reset_cart_count(order.user)
+    return True
+
+
+def apply_status(payment_id, status, amount=None):
+    """
+    Применение статуса платежа к заказу.
+    succeeded - заказ закрывается, canceled - платеж отвязывается от заказа
+    и пользователь может оплатить корзину заново (отмененный замененный
+    платеж просто забывается).
+    Возвращает True, если статус окончательный.
+    """
+    order = payment_orders(payment_id).filter(close=False).first()
+    if order is None:
+        if (status == 'succeeded'
+                and not Order.objects.filter(payment=payment_id).exists()):
+            # Например, замененный платеж заказа, уже закрытого новым
+            logger.error('Платеж %s оплачен, но заказ им не закрыт',
+                         payment_id)
+        return True
+    if status == 'succeeded':
+        settle_order(order.id, payment_id, amount)
+    elif status == 'canceled' and order.payment == payment_id:
+        Order.objects.filter(
+            id=order.id, payment=payment_id, close=False
+        ).update(payment='', amount=0)
+    elif status == 'canceled':
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(id=order.id)
+            order.superseded_payments.pop(payment_id, None)
+            order.save(update_fields=['superseded_payments'])
+    else:
+        return False
+    return True
+
+
+@job('check_payment')
+def check_payment(payment_id):
+    """
+    Проверка платежа по уведомлению или возврату пользователя.
+    Статус всегда запрашивается у шлюза, телу уведомления не доверяем.
+    """
+    payment = get_gateway().find(payment_id)
+    if not apply_status(payment_id, payment['status'], payment['amount']):
+        raise PaymentPending(payment_id)
+
+
+def check_payment_later(payment_id, source):
+    """
+    Постановка проверки платежа, одна задача на источник события.
+    Новое событие ставит уже выполненную задачу заново и ускоряет
+    отложенную: возврат пользователя проверяется сразу.
+    """
+    return enqueue('check_payment', f'payment-{payment_id}-{source}',
+                   repeat=True, payment_id=payment_id)
@@ -0,0 +1,484 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from books.models import Book, BookFiles
+from books.tests import temporary_root
+from books.validator import BOOK_FILES_DIRECTORY
+from bookstore.settings import JOBS_MAX_ATTEMPTS, PAYMENT_TIMEOUT
+from users.downloads import zip_stream
+from users.jobs import enqueue, run_pending
+from users.models import CustomUser, Job, Order, Review
+from users.payments import (STUB_CACHE_KEY, PaymentMismatch, StubGateway,
+                            TimeoutApiClient, check_payment_later,
+                            settle_order)
+
+
+def create_book(name='Книга', price=100, **fields):
+    return Book.objects.create(
+        name=name, author='Автор', description='Описание',
+        fragment='Отрывок', pages=100, main_image='books/test.jpg',
+        price=price, release=2000, **fields
+    )
+
+
+def create_user(username='reader'):
+    return CustomUser.objects.create_user(
+        username, f'{username}@example.com', 'password-12345'
+    )
+
+
+class ReviewCountersTest(TestCase):
+    def setUp(self):
+        self.book = create_book()
+        self.users = [create_user(f'reader{index}') for index in range(3)]
+        self.reviews = [
+            Review.objects.create(
+                user=user, book=self.book, comment='Отзыв', score=score
+            )
+            for user, score in zip(self.users, (5, 4, 3))
+        ]
+
+    def assertCounters(self, count, total, score):
+        self.book.refresh_from_db()
+        self.assertEqual(
+            (self.book.review_count, self.book.review_sum, self.book.score),
+            (count, total, score)
+        )
+
+    def test_counters_follow_reviews(self):
+        self.assertCounters(3, 12, 4)
+        review = self.reviews[0]
+        review.score = 1
+        review.save()
+        self.assertCounters(3, 8, 2)
+        review.delete()
+        self.assertCounters(2, 7, 3)
+
+    def test_delete_with_stale_counters_recounts(self):
+        """Счетчики базы до recount_reviews: удаление отзыва без ошибки"""
+        Book.objects.update(review_count=0, review_sum=0, score=0)
+        self.client.force_login(self.users[0])
+        response = self.client.post(
+            reverse('users:change_review',
+                    args=[self.book.id, self.reviews[0].id]),
+            {'delete': ''}
+        )
+        self.assertRedirects(
+            response, reverse('books:book', args=[self.book.id]),
+            fetch_redirect_response=False
+        )
+        self.assertCounters(2, 7, 3)
+
+    def test_recount_reviews_before_new_review(self):
+        updated_at = timezone.now() - timedelta(days=1)
+        Book.objects.update(
+            review_count=0, review_sum=0, score=0, updated_at=updated_at
+        )
+        call_command('recount_reviews', stdout=StringIO())
+        self.assertCounters(3, 12, 4)
+        self.assertGreater(self.book.updated_at, updated_at)
+        Review.objects.create(
+            user=create_user(), book=self.book, comment='Отзыв', score=1
+        )
+        self.assertCounters(4, 13, 3)
+
+
+class OrderMailJobTest(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.books = [create_book('Мастер'), create_book('Остров')]
+        BookFiles.objects.create(
+            book=self.books[0], name='PDF', file='books_file/1.pdf'
+        )
+        BookFiles.objects.create(
+            book=self.books[0], name='EPUB', file='books_file/1.epub'
+        )
+        # Задачи миниатюр новых обложек в этих тестах не нужны
+        Job.objects.all().delete()
+        self.order = self.user.order.get(close=False)
+        self.order.book.add(*self.books)
+        self.order.close = True
+        self.order.save()
+        self.job = enqueue(
+            'order_mail', f'order-mail-{self.order.id}',
+            order_id=self.order.id
+        )
+
+    def test_mail_with_order_books(self):
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, [self.user.email])
+        self.assertEqual(
+            message.subject,
+            f'Заказ #{self.user.id}-{self.order.id} оплачен'
+        )
+        html = message.alternatives[0][0]
+        for book in self.books:
+            self.assertIn(f'{book.name}:', html)
+        for name in ('PDF', 'EPUB'):
+            self.assertIn(
+                reverse('users:get_book', args=[self.books[0].id, name]),
+                html
+            )
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'done')
+
+    def test_same_key_sends_once(self):
+        enqueue('order_mail', f'order-mail-{self.order.id}',
+                order_id=self.order.id)
+        run_pending()
+        self.assertEqual(run_pending(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @mock.patch('users.jobs.send_mail', side_effect=SMTPException('down'))
+    def test_retry_then_failed(self, send_mail):
+        with self.assertLogs('users.jobs', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'pending')
+        self.assertEqual(self.job.attempts, 1)
+        self.assertGreater(self.job.run_after, timezone.now())
+        self.assertIn('SMTPException', self.job.last_error)
+        self.assertEqual(run_pending(), (0, 0))
+        for _ in range(JOBS_MAX_ATTEMPTS - 1):
+            Job.objects.filter(id=self.job.id).update(
+                run_after=timezone.now()
+            )
+            with self.assertLogs('users.jobs', 'ERROR'):
+                run_pending()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertEqual(send_mail.call_count, JOBS_MAX_ATTEMPTS)
+        self.assertEqual(mail.outbox, [])
+
+
+@mock.patch('users.payments.PAYMENT_GATEWAY', 'stub')
+class PaymentTest(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.books = [create_book('Мастер', 300), create_book('Остров', 200)]
+        self.order = self.user.order.get(close=False)
+        self.order.book.add(*self.books)
+        self.client.force_login(self.user)
+        self.gateway = StubGateway()
+
+    def pay(self):
+        response = self.client.post(reverse('users:payment'))
+        self.assertEqual(response.status_code, 302)
+        self.order.refresh_from_db()
+        return response['Location']
+
+    def check(self):
+        Job.objects.filter(name='check_payment').update(
+            run_after=timezone.now()
+        )
+        run_pending()
+        self.order.refresh_from_db()
+
+    def test_pending_payment_is_resumed(self):
+        """Брошенная оплата не блокирует корзину: та же страница оплаты"""
+        url = self.pay()
+        payment_id = self.order.payment
+        self.assertEqual(self.order.amount, 500)
+        self.assertEqual(self.pay(), url)
+        self.assertEqual(self.order.payment, payment_id)
+
+    def test_canceled_payment_is_replaced(self):
+        self.pay()
+        payment_id = self.order.payment
+        self.gateway.set_status(payment_id, 'canceled')
+        self.pay()
+        self.assertNotEqual(self.order.payment, payment_id)
+        self.assertEqual(self.gateway.get(self.order.payment)['amount'], 500)
+
+    def test_changed_cart_gets_new_payment(self):
+        self.pay()
+        payment_id = self.order.payment
+        self.order.book.remove(self.books[1])
+        self.pay()
+        self.assertNotEqual(self.order.payment, payment_id)
+        self.assertEqual(self.order.amount, 300)
+        self.assertEqual(
+            list(self.order.lines.values_list('book_id', flat=True)),
+            [self.books[0].id]
+        )
+
+    def test_gateway_error_keeps_payment(self):
+        self.pay()
+        payment_id = self.order.payment
+        with mock.patch.object(StubGateway, 'find', side_effect=OSError), \
+                self.assertLogs('users.views', 'ERROR'):
+            response = self.client.post(reverse('users:payment'))
+        self.assertRedirects(
+            response, reverse('users:cart', args=[1]),
+            fetch_redirect_response=False
+        )
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment, payment_id)
+
+    def test_unknown_payment_is_replaced(self):
+        self.pay()
+        payment_id = self.order.payment
+        caches['payments'].delete(STUB_CACHE_KEY.format(payment_id))
+        self.pay()
+        self.assertNotEqual(self.order.payment, payment_id)
+        self.assertEqual(self.order.superseded_payments, {})
+
+    def test_replaced_payment_settles_order(self):
+        """Оплата замененного платежа закрывает заказ по его строкам"""
+        self.pay()
+        old_payment = self.order.payment
+        self.order.book.remove(self.books[1])
+        self.pay()
+        self.assertIn(old_payment, self.order.superseded_payments)
+        self.gateway.set_status(old_payment, 'succeeded')
+        check_payment_later(old_payment, 'notification')
+        self.check()
+        self.assertTrue(self.order.close)
+        self.assertEqual(
+            (self.order.payment, self.order.amount), (old_payment, 500)
+        )
+        self.assertEqual(
+            set(self.user.buyed_books.values_list('id', flat=True)),
+            {book.id for book in self.books}
+        )
+
+    def test_canceled_replaced_payment_is_forgotten(self):
+        self.pay()
+        old_payment = self.order.payment
+        self.order.book.remove(self.books[1])
+        self.pay()
+        self.gateway.set_status(old_payment, 'canceled')
+        check_payment_later(old_payment, 'notification')
+        self.check()
+        self.assertFalse(self.order.close)
+        self.assertEqual(self.order.superseded_payments, {})
+        self.assertEqual(self.order.amount, 300)
+
+    def test_settle_uses_lines_from_payment(self):
+        """Книга, добавленная в корзину после создания платежа, остается"""
+        self.pay()
+        extra = create_book('Сад', 700)
+        self.order.book.add(extra)
+        self.gateway.set_status(self.order.payment, 'succeeded')
+        check_payment_later(self.order.payment, 'notification')
+        self.check()
+        self.assertTrue(self.order.close)
+        self.assertEqual(self.order.amount, 500)
+        self.assertEqual(
+            set(self.user.buyed_books.values_list('id', flat=True)),
+            {book.id for book in self.books}
+        )
+        self.assertEqual(
+            set(self.order.book.values_list('id', flat=True)),
+            {book.id for book in self.books}
+        )
+        cart = self.user.order.get(close=False)
+        self.assertEqual(list(cart.book.all()), [extra])
+
+    def test_amount_mismatch_keeps_order_open(self):
+        self.pay()
+        with self.assertRaises(PaymentMismatch):
+            settle_order(self.order.id, self.order.payment, 100)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.close)
+        self.assertFalse(self.user.buyed_books.exists())
+
+    def test_return_repeats_finished_check(self):
+        self.pay()
+        job = check_payment_later(self.order.payment, 'return')
+        Job.objects.filter(id=job.id).update(status='failed', attempts=5)
+        self.gateway.set_status(self.order.payment, 'succeeded')
+        response = self.client.get(
+            reverse('users:payment'), {'order': self.order.id}
+        )
+        self.assertRedirects(
+            response, reverse('users:cart', args=[3]),
+            fetch_redirect_response=False
+        )
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 0))
+        self.check()
+        self.assertTrue(self.order.close)
+        self.assertTrue(Order.objects.filter(
+            user=self.user, close=False
+        ).exists())
+
+    def test_gateway_requests_have_timeout(self):
+        session = TimeoutApiClient().get_session()
+        self.assertEqual(session.request.keywords['timeout'], PAYMENT_TIMEOUT)
+
+
+class ConcurrentSettleTest(TransactionTestCase):
+    """Одновременная оплата заказов с общими книгами из разных потоков"""
+    buyers = 8
+
+    def setUp(self):
+        self.books = [create_book(f'Книга {i}', 100) for i in range(3)]
+        self.orders = []
+        for i in range(self.buyers):
+            order = create_user(f'reader{i}').order.get(close=False)
+            order.book.add(*self.books)
+            order.fill_lines()
+            order.payment = f'payment-{i}'
+            order.save(update_fields=['payment', 'amount'])
+            self.orders.append(order)
+
+    def settle(self, order):
+        try:
+            for _ in range(50):
+                try:
+                    return settle_order(order.id, order.payment, 300)
+                except OperationalError:
+                    # SQLite блокирует базу целиком на время записи
+                    time.sleep(0.05)
+            raise AssertionError(f'Заказ {order.id} не оплачен')
+        finally:
+            connections.close_all()
+
+    def test_parallel_settle(self):
+        orders = self.orders + self.orders
+        with ThreadPoolExecutor(self.buyers) as executor:
+            settled = list(executor.map(self.settle, orders))
+        self.assertEqual(settled.count(True), self.buyers)
+        for book in self.books:
+            book.refresh_from_db()
+            self.assertEqual(book.buying, self.buyers)
+        for order in self.orders:
+            order.refresh_from_db()
+            self.assertTrue(order.close)
+            self.assertEqual(order.book.count(), len(self.books))
+            self.assertEqual(
+                order.user.buyed_books.count(), len(self.books)
+            )
+            cart = order.user.order.get(close=False)
+            self.assertFalse(cart.book.exists())
+        self.assertEqual(Order.objects.count(), 2 * self.buyers)
+
+
+class MediaServeTest(TestCase):
+    def setUp(self):
+        root = temporary_root(self, 'MEDIA_ROOT')
+        directory = os.path.join(
+            root, BOOK_FILES_DIRECTORY, 'media-serve-test'
+        )
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'book.pdf'), 'wb') as file:
+            file.write(b'%PDF book')
+        with open(os.path.join(root, 'media-serve-test.txt'), 'w') as file:
+            file.write('cover')
+
+    def test_book_files_are_not_served(self):
+        name = f'{BOOK_FILES_DIRECTORY}/media-serve-test/book.pdf'
+        for url in (f'/{name}', f'/books/../{name}', f'/./{name}'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_other_media_is_served(self):
+        response = self.client.get('/media-serve-test.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'cover')
+
+
+class ZipStreamTest(TestCase):
+    """Память при сборке архива не растет вместе с размером файлов"""
+    chunk_size = 64 * 1024
+    chunks = 128
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, chunk):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as file:
+            for _ in range(self.chunks):
+                file.write(chunk)
+        return path, name
+
+    def test_memory_bound(self):
+        files = [
+            self.write('book.pdf', os.urandom(self.chunk_size)),
+            self.write('book.fb2', b'line ' * (self.chunk_size // 5)),
+        ]
+        tracemalloc.start()
+        try:
+            size = sum(
+                len(chunk) for chunk in zip_stream(files, self.chunk_size)
+            )
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(size, self.chunks * self.chunk_size)
+        self.assertLess(peak, 8 * self.chunk_size)
+
+
+class LibraryZipTest(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.other = create_user('other')
+        self.books = [create_book('Мастер'), create_book('Остров'),
+                      create_book('Чужая')]
+        temporary_root(self, 'BOOK_FILES_ROOT')
+        for book in self.books:
+            for name in ('PDF', 'FB2'):
+                book_file = BookFiles(book=book, name=name)
+                book_file.file.save(f'{book.id}.{name.lower()}', ContentFile(
+                    f'{book.name} {name}' * 1000
+                ))
+        self.user.buyed_books.add(*self.books[:2])
+        self.other.buyed_books.add(self.books[2])
+        self.client.force_login(self.user)
+
+    def archive(self, data=None):
+        response = self.client.get(reverse('users:library_zip'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(
+            response.streaming_content
+        )))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_whole_library(self):
+        archive = self.archive()
+        self.assertEqual(sorted(archive.namelist()), [
+            'Мастер/Мастер.fb2', 'Мастер/Мастер.pdf',
+            'Остров/Остров.fb2', 'Остров/Остров.pdf',
+        ])
+        self.assertEqual(
+            archive.read('Остров/Остров.fb2').decode(), 'Остров FB2' * 1000
+        )
+
+    def test_selected_books_of_user_only(self):
+        """Чужая купленная книга не попадает в архив даже по id"""
+        archive = self.archive({
+            'selected': 1, 'book': [self.books[1].id, self.books[2].id]
+        })
+        self.assertEqual(sorted(archive.namelist()),
+                         ['Остров/Остров.fb2', 'Остров/Остров.pdf'])
+
+    def test_empty_selection_returns_to_library(self):
+        response = self.client.get(reverse('users:library_zip'),
+                                   {'selected': 1})
+        self.assertRedirects(response, reverse('users:library'),
+                             fetch_redirect_response=False)
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from queue import Empty, Full, Queue
+
+from django.db import close_old_connections
+
+from .models import CustomUser, ViewedGenres
+from bookstore.settings import (VIEWS_BATCH_SIZE, VIEWS_BUFFER_SIZE,
+                                VIEWS_FLUSH_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+
+class ViewTracker:
+    """
+    Буфер просмотров жанров пользователями.
+    Страница книги только кладет события в очередь, фоновый поток
+    раз в flush_interval секунд (или по набору batch_size событий)
+    записывает их одним bulk_create и один раз на пользователя
+    обновляет его буфер жанров.
+    Счетчики stats: queued - принято, dropped - отброшено при
+    переполнении очереди, late - записано позже 2 * flush_interval,
+    flushed - записано, failed - не записано из-за ошибки БД.
+    """
+
+    def __init__(self, buffer_size, flush_interval, batch_size):
+        self.queue = Queue(maxsize=buffer_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.stats = dict.fromkeys(
+            ('queued', 'dropped', 'late', 'flushed', 'failed'), 0
+        )
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def track(self, user_id, genre_ids):
+        """Постановка просмотров в очередь без ожидания записи в БД"""
+        self._ensure_worker()
+        now = time.monotonic()
+        for genre_id in genre_ids:
+            try:
+                self.queue.put_nowait((user_id, genre_id, now))
+            except Full:
+                self._count('dropped')
+                logger.warning('Буфер просмотров переполнен')
+            else:
+                self._count('queued')
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _worker_alive(self):
+        return (self._thread is not None and self._thread.is_alive()
+                and self._pid == os.getpid())
+
+    def _ensure_worker(self):
+        """Поток запускается при первом событии и заново после fork"""
+        if self._worker_alive():
+            return
+        with self._lock:
+            if self._worker_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='view-tracker', daemon=True
+            )
+            self._thread.start()
+
+    def _collect(self):
+        """Набор событий до batch_size или до истечения flush_interval"""
+        events = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(events) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                events.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return events
+
+    def _drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except Empty:
+                return events
+
+    def _run(self):
+        while True:
+            events = self._collect()
+            if events:
+                self.flush(events)
+
+    def flush(self, events=None):
+        """Запись событий одним INSERT и одно обновление на пользователя"""
+        if events is None:
+            events = self._drain()
+        if not events:
+            return
+        close_old_connections()
+        try:
+            ViewedGenres.objects.bulk_create(
+                ViewedGenres(user_id=user_id, genre_id=genre_id)
+                for user_id, genre_id, _ in events
+            )
+            user_genres = defaultdict(list)
+            for user_id, genre_id, _ in events:
+                user_genres[user_id].append(genre_id)
+            for user in CustomUser.objects.filter(id__in=user_genres):
+                user.add_viewed_genres(user_genres[user.id])
+        except Exception:
+            self._count('failed', len(events))
+            logger.exception('Не удалось записать просмотры жанров')
+        else:
+            now = time.monotonic()
+            self._count('flushed', len(events))
+            self._count('late', sum(
+                now - queued > 2 * self.flush_interval
+                for _, _, queued in events
+            ))
+        finally:
+            close_old_connections()
+
+
+view_tracker = ViewTracker(
+    VIEWS_BUFFER_SIZE, VIEWS_FLUSH_INTERVAL, VIEWS_BATCH_SIZE
+)
+atexit.register(view_tracker.flush)
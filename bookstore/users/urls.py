@@ -41,9 +41,22 @@ urlpatterns = [
     path(
         'payment', views.payment, name='payment'
     ),
+    path(
+        'payment/notification',
+        views.payment_notification,
+        name='payment_notification'
+    ),
+    path(
+        'payment/stub/<str:payment_id>',
+        views.payment_stub,
+        name='payment_stub'
+    ),
     path(
         'library', views.library, name='library'
     ),
+    path(
+        'library/zip', views.library_zip, name='library_zip'
+    ),
     path(
         'get_book/<int:book_id>/<str:format>', views.get_book, name='get_book'
     ),
@@ -1,24 +1,34 @@
 import django.contrib.auth as auth
 from django.template.response import TemplateResponse
-from django.db.models import F
+from django.db import transaction
+from django.db.models import Sum
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse, reverse_lazy
 from django.http import JsonResponse
-from django.core.mail import send_mail
 from http import HTTPStatus
 from django.contrib.auth.forms import AuthenticationForm
-from django.http import HttpResponseRedirect
-import uuid
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+import logging
+import os
 from django.core.paginator import Paginator
-from yookassa import Payment
-from datetime import date
 
-from books.models import Book
-from books.views import catalog_type, main_forms
+from books.models import Book, BookFiles
+from books.views import catalog_type
+from .cart import aget_cart_count
+from .downloads import file_response, library_files, zip_stream
 from .forms import SignupForm, ChangeForm
-from .models import Review, Order
-from bookstore.settings import MAX_ORDERS_PROFILE, EMAIL_HOST_USER, DOMEN
+from .payments import check_payment_later, get_gateway
+from .models import Review
+from bookstore.settings import MAX_ORDERS_PROFILE, DOMEN
+
+logger = logging.getLogger(__name__)
 
 
 def signup(request):
@@ -69,52 +79,38 @@ def favorite(request, sort='buying'):
 
 
 @login_required
+@transaction.atomic
 def create_review(request, book_id):
-    """Создание нового отзыва"""
+    """Создание нового отзыва, оценка книги пересчитывается в Review"""
     book = get_object_or_404(Book, id=book_id)
     user = request.user
     if request.method == 'POST' and not book.review.filter(user=user).exists():
         data = request.POST
-        score = int(data['score'])
-        if 0 >= score > 5:
-            score = 5
         Review.objects.create(
             user=user,
             book=book,
             comment=data['text'],
-            score=score
+            score=min(max(int(data['score']), 1), 5)
         )
-        if book.review.all():
-            score_list = [review.score for review in book.review.all()]
-            book.score = sum(score_list) / len(score_list)
-            book.save()
         return JsonResponse(status=HTTPStatus.OK, data={})
     return redirect('books:book', book_id=book_id)
 
 
 @login_required
+@transaction.atomic
 def change_review(request, book_id, review_id):
     """Изменение или удаление отзыва"""
-    book = get_object_or_404(Book, id=book_id)
-    review = Review.objects.filter(id=review_id)
+    review = Review.objects.filter(
+        id=review_id, book_id=book_id, user=request.user
+    ).first()
     if request.method == 'POST' and review:
         data = request.POST
         if 'delete' in data:
             review.delete()
         else:
-            score = int(data['score'])
-            if 0 >= score > 5:
-                score = 5
-            review.update(
-                comment=data['text'],
-                score=score
-            )
-        if book.review.all():
-            score_list = [review.score for review in book.review.all()]
-            book.score = sum(score_list) / len(score_list)
-        else:
-            book.score = 0
-        book.save()
+            review.comment = data['text']
+            review.score = min(max(int(data['score']), 1), 5)
+            review.save()
     return redirect('books:book', book_id=book_id)
 
 
@@ -123,16 +119,12 @@ def profile(request):
     """Профиль"""
     user = request.user
     change_form = ChangeForm(instance=user)
-    orders = user.order.filter(close=True)
+    orders = user.order.filter(close=True).order_by(
+        '-close_data', '-id'
+    ).prefetch_related('lines', 'book')
     paginator = Paginator(orders, MAX_ORDERS_PROFILE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-    orders_amount = []
-    amount = 0
-    for order in page_obj:
-        for book in order.book.all():
-            amount += book.price * (100 - book.discount) / 100
-        orders_amount.append(amount)
     if request.method == 'POST':
         data = request.POST
         change_form = ChangeForm(
@@ -151,9 +143,7 @@ def profile(request):
     context = {
         'page_obj': page_obj,
         'change_form': change_form,
-        'orders_amount': orders_amount
     }
-    context.update(main_forms(request))
     return TemplateResponse(request, 'users/profile.html', context)
 
 
@@ -165,95 +155,165 @@ def cart(request, buy=0):
     1 - пользователь вернулся с оплаты не оплатив,
     2 - пользователь вернулся с оплаты оплатив"""
     books_order = request.user.order.get(close=False).book.all()
-    price = sum(books_order.annotate(
-        total_price=(F('price') * (100 - F('discount'))) / 100
-    ).values_list('total_price', flat=True))
+    price = books_order.aggregate(price=Sum('final_price'))['price'] or 0
 
     context = {
         'books_order': books_order,
         'price': price,
         'buy': buy
     }
-    context.update(main_forms(request))
     return TemplateResponse(request, 'users/cart.html', context)
 
 
-def take_cart_img(request, order_full=False):
-    if request.user.is_authenticated:
-        order_full = request.user.order.get(close=False).book.all().exists()
-    return TemplateResponse(
-        request, 'includes/cart_img.html', {'order_full': order_full}
-    )
+async def take_cart_img(request):
+    """Иконка корзины, запрашивается страницей после изменения корзины.
+    Async view: размер корзины читается из кеша без потока сервера,
+    order_full из main_forms заменяется значением из контекста"""
+    user = await request.auser()
+    context = {
+        'user': user,
+        'order_full': user.is_authenticated and bool(
+            await aget_cart_count(user)
+        )
+    }
+    return render(request, 'includes/cart_img.html', context)
 
 
 @login_required
 def payment(request):
-    """Процесс оплаты и проверка что оплата успешна.
-    id платежа встраивается в order.
-    Если оплата неуспешна, id удаляется и создается новая оплата"""
+    """Оплата корзины и возврат пользователя со страницы оплаты.
+    POST - создание платежа: книги и цены фиксируются в строках заказа,
+    id платежа встраивается в order. Если платеж уже создан и ожидает
+    оплаты, а корзина не менялась, пользователь возвращается на его
+    страницу оплаты. Отмененный, просроченный или неизвестный шлюзу
+    платеж и платеж за изменившуюся корзину заменяются новым.
+    Еще не оплаченный замененный платеж запоминается в заказе
+    (superseded_payments): если пользователь все же оплатит его,
+    заказ закроется по его строкам. При ошибке шлюза пользователь
+    возвращается в корзину с предложением повторить оплату.
+    GET ?order=<id> - возврат с оплаты: статус платежа не запрашивается,
+    заказ закрывается по уведомлению шлюза (payment_notification),
+    а здесь только ставится проверка в очередь на случай его задержки"""
     user = request.user
-    order = user.order.filter(close=False)[0]
-    if order.payment:
-        if 'succeeded' == Payment.find_one(order.payment).status:
-            html_message = (f'Вы успешно оплатили заказ на '
-                            f'<a href="{DOMEN}">сайте</a>!<br>'
-                            'Нажмите на формат для скачивания книги:<br><br>')
-            for book in order.book.all():
-                user.buyed_books.add(book)
-                html_message += f'{book.name}:<br>'
-                for file in book.files.all():
-                    html_message += (f'&emsp;<a href="{DOMEN}{file.file.url}">'
-                                     f'{file.name}</a><br>')
-            send_mail(subject=f'Заказ #{user.id}-{order.id} оплачен',
-                      message=None,
-                      from_email=EMAIL_HOST_USER,
-                      recipient_list=[user.email],
-                      html_message=html_message)
-            order.close = True
-            order.close_data = date.today()
-            Order.objects.create(user=user)
-            book.buying += 1
-            book.save()
+    if request.method == 'GET':
+        if 'order' in request.GET:
+            order = get_object_or_404(user.order, id=request.GET['order'])
+        else:
+            order = user.order.filter(close=False)[0]
+        if order.close:
             buy = 2
+        elif order.payment:
+            check_payment_later(order.payment, 'return')
+            buy = 3
         else:
-            order.payment = ''
-            order.amount = 0
             buy = 1
-        order.save()
         return redirect('users:cart', buy=buy)
-    price = sum(order.book.annotate(
-        total_price=(F('price') * (100 - F('discount'))) / 100
-    ).values_list('total_price', flat=True))
-    payment = Payment.create({
-        "amount": {
-            "value": f"{float(price)}",
-            "currency": "RUB"
-        },
-        "confirmation": {
-            "type": "redirect",
-            "return_url": f'{DOMEN}/my/payment'
-
-        },
-        "capture": True
-    }, uuid.uuid4())
-    order.payment = payment.id
-    order.amount = price
-    order.save()
-    return HttpResponseRedirect(payment.confirmation.confirmation_url)
+    order = user.order.filter(close=False)[0]
+    gateway = get_gateway()
+    try:
+        payment = gateway.find(order.payment) if order.payment else None
+    except LookupError:
+        payment = None
+    except Exception:
+        logger.exception('Платеж %s не проверен', order.payment)
+        return redirect('users:cart', buy=1)
+    previous = order.lines_snapshot()
+    if payment is not None:
+        if payment['status'] in ('succeeded', 'waiting_for_capture'):
+            check_payment_later(order.payment, 'return')
+            return redirect('users:cart', buy=3)
+        if payment['status'] == 'pending':
+            if payment['confirmation_url'] and order.lines_match_cart():
+                return HttpResponseRedirect(payment['confirmation_url'])
+            order.superseded_payments[order.payment] = previous
+    order.fill_lines()
+    try:
+        payment_id, confirmation_url = gateway.create(
+            order.amount,
+            f'{DOMEN}{reverse("users:payment")}?order={order.id}'
+        )
+    except Exception:
+        logger.exception('Платеж заказа %s не создан', order.id)
+        order.restore_lines(previous)
+        return redirect('users:cart', buy=1)
+    order.payment = payment_id
+    order.save(update_fields=['payment', 'amount', 'superseded_payments'])
+    return HttpResponseRedirect(confirmation_url)
+
+
+@csrf_exempt
+@require_POST
+def payment_notification(request):
+    """Уведомление шлюза о смене статуса платежа.
+    Ответ отдается сразу, заказ закрывает фоновая задача check_payment"""
+    if not get_gateway().is_trusted(request):
+        return HttpResponseForbidden()
+    try:
+        payment_id = json.loads(request.body)['object']['id']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest()
+    check_payment_later(payment_id, 'notification')
+    return HttpResponse()
+
+
+def payment_stub(request, payment_id):
+    """Страница оплаты локальной заглушки шлюза.
+    ?status=canceled - отмена платежа, иначе платеж успешен"""
+    gateway = get_gateway()
+    if gateway.name != 'stub' or gateway.get(payment_id) is None:
+        raise Http404
+    payment = gateway.set_status(
+        payment_id, request.GET.get('status', 'succeeded')
+    )
+    check_payment_later(payment_id, 'notification')
+    return HttpResponseRedirect(payment['return_url'])
 
 
 @login_required
 def library(request):
     """Купленные книги пользователя (библиотека)"""
     context = {
-        'buyed_books': request.user.buyed_books.all()
+        'buyed_books': request.user.buyed_books.prefetch_related('files')
     }
-    context.update(main_forms(request))
     return TemplateResponse(request, 'users/library.html', context)
 
 
+@login_required
+def library_zip(request):
+    """Скачивание всей библиотеки или выбранных книг (?book=id) одним ZIP.
+    Форма "Скачать выбранные" передает selected: без отмеченных книг
+    пользователь возвращается в библиотеку, а не получает ее целиком.
+    Архив собирается по ходу отправки, не целиком в памяти"""
+    book_files = BookFiles.objects.filter(
+        book__users_buying=request.user
+    ).select_related('book').order_by('book__name', 'book_id', 'name')
+    if 'selected' in request.GET or 'book' in request.GET:
+        book_ids = [book_id for book_id in request.GET.getlist('book')
+                    if book_id.isdigit()]
+        if not book_ids:
+            return redirect('users:library')
+        book_files = book_files.filter(book_id__in=book_ids)
+    response = StreamingHttpResponse(
+        zip_stream(library_files(book_files.iterator())),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = content_disposition_header(
+        True, 'Библиотека.zip'
+    )
+    return response
+
+
 @login_required
 def get_book(request, book_id, format):
-    """Возвращаем ссылку на запрашиваемый формат файла"""
-    book = get_object_or_404(request.user.buyed_books, id=book_id)
-    return redirect('../../../' + book.files.all().get(name=format).file.url)
+    """Скачивание купленной книги в выбранном формате.
+    Покупка проверяется тем же запросом, что находит файл"""
+    book_file = get_object_or_404(
+        BookFiles.objects.select_related('book'),
+        book_id=book_id,
+        name=format,
+        book__users_buying=request.user,
+    )
+    extension = os.path.splitext(book_file.file.name)[1]
+    return file_response(
+        request, book_file.file, f'{book_file.book.name}{extension}'
+    )